@@ -1,9 +1,15 @@
 import tkinter as tk
-from tkinter import filedialog, messagebox, simpledialog
-from PIL import Image, ImageTk
-import os
-import face_recognition
-import shutil
+from tkinter import filedialog, messagebox, simpledialog, ttk
+import queue
+import numpy as np
+from face_clustering import FaceClusterer
+from face_index import FaceIndex
+from face_pipeline import FaceEncodingPipeline
+from folder_export import EXPORT_MODES, FolderExport
+from folder_scanner import FolderScanner
+from folder_watcher import FolderWatcher
+from thumbnail_cache import ThumbnailCache
+from thumbnail_grid import ThumbnailGrid
 
 class ImagePlannerApp:
     def __init__(self, root, main_app):
@@ -20,118 +26,335 @@ class ImagePlannerApp:
         self.load_folder_button = tk.Button(self.left_frame, text="Load Folder", command=self.load_folder)
         self.load_folder_button.pack(pady=10)
 
+        self.watch_folder = tk.BooleanVar(value=False)
+        self.watch_folder_button = tk.Checkbutton(self.left_frame, text="Watch Folder", variable=self.watch_folder,
+                                                  command=self.toggle_watch, bg='lightgray')
+        self.watch_folder_button.pack(pady=5)
+
         self.sort_images_button = tk.Button(self.left_frame, text="Sort Images by Faces", command=self.sort_images)
         self.sort_images_button.pack(pady=10)
 
+        self.progress_bar = ttk.Progressbar(self.left_frame, mode="determinate")
+        self.progress_bar.pack(fill="x", padx=10)
+
+        self.cancel_sort_button = tk.Button(self.left_frame, text="Cancel Sorting", command=self.cancel_sort,
+                                            state="disabled")
+        self.cancel_sort_button.pack(pady=5)
+
+        self.find_person_button = tk.Button(self.left_frame, text="Find Person in All Images",
+                                            command=self.find_person)
+        self.find_person_button.pack(pady=10)
+
         self.download_folders_button = tk.Button(self.left_frame, text="Download Sorted Folders", command=self.download_sorted_folders)
         self.download_folders_button.pack(pady=10)
 
+        self.export_mode = tk.StringVar(value="copy")
+        self.export_mode_box = ttk.Combobox(self.left_frame, textvariable=self.export_mode, values=EXPORT_MODES,
+                                            state="readonly", width=10)
+        self.export_mode_box.pack(pady=5)
+
         self.group_listbox = tk.Listbox(self.left_frame)
         self.group_listbox.pack(fill="y", pady=10)
         self.group_listbox.bind("<<ListboxSelect>>", self.display_group_images)
         self.group_listbox.bind("<Double-1>", self.rename_group)
 
-        self.image_canvas = tk.Canvas(self.right_frame, bg="white")
-        self.image_canvas.pack(fill="both", expand=True)
-        self.image_canvas.bind("<Button-1>", self.on_image_click)
+        self.thumbnail_grid = ThumbnailGrid(self.right_frame, on_click=self.on_image_click,
+                                            cache=ThumbnailCache(size=100))
 
         self.image_paths = []
-        self.thumbnails = []
-        self.known_face_encodings = []
-        self.known_face_paths = []
+        self.face_index = FaceIndex()
         self.groups = {}
-        self.image_position_mapping = {}
+        self.group_labels = {}  # Group name -> person label in face_index
+        self.face_clusterer = FaceClusterer(tolerance=0.6)
+        self.pipeline = None
+        self.export = None
+        self.scanner = None
+        self.group_centers = []
+        self.streaming_groups = []  # Group lists while sorting, in the same order as group_centers
+        self.folder_path = None
+        self.watcher = None
+        self.update_pipeline = None  # Encodes files the watcher reported, one batch at a time
+        self.pending_updates = set()
+        self.shown_paths = None  # The list the grid currently shows, so watch updates can extend it
 
     def load_folder(self):
         folder_path = filedialog.askdirectory()
         if folder_path:
+            if self.scanner is not None:
+                self.scanner.cancel()
             self.image_paths.clear()
-            for root, _, files in os.walk(folder_path):
-                for file in files:
-                    if file.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp')):
-                        self.image_paths.append(os.path.join(root, file))
-            messagebox.showinfo("Success", f"Loaded {len(self.image_paths)} images from folder.")
             self.display_images()
+            # The folder is scanned in the background and the grid fills in as directories are listed
+            self.folder_path = folder_path
+            self.scanner = FolderScanner(folder_path).start()
+            self.root.after(50, self.poll_scan_results, self.scanner)
+            if self.watch_folder.get():
+                self.start_watching()
+
+    def poll_scan_results(self, scanner):
+        if scanner is not self.scanner:
+            return  # A newer folder replaced this scan
+        found = []
+        while True:
+            try:
+                message = scanner.results.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == "done":
+                self.scanner = None
+                self.add_images(found)
+                if not message[1]:
+                    messagebox.showinfo("Success", f"Loaded {len(self.image_paths)} images from folder.")
+                return
+            found += message[1]
+
+        if found:
+            self.add_images(found)
+        self.root.after(100, self.poll_scan_results, scanner)
+
+    def add_images(self, image_paths):
+        """Appends images not loaded yet (the scan and the watcher can both report a file). Returns the new ones."""
+        known = set(self.image_paths)
+        new_paths = [path for path in dict.fromkeys(image_paths) if path not in known]
+        self.image_paths.extend(new_paths)
+        if self.shown_paths is self.image_paths and new_paths:
+            self.thumbnail_grid.add_paths(new_paths)
+        return new_paths
 
     def display_images(self):
-        self.image_canvas.delete("all")
-        self.thumbnails.clear()
-        self.image_position_mapping.clear()
-
-        x, y = 10, 10
-        for image_path in self.image_paths:
-            image = Image.open(image_path)
-            image.thumbnail((100, 100))
-            photo = ImageTk.PhotoImage(image)
-            image_id = self.image_canvas.create_image(x, y, anchor="nw", image=photo)
-            self.thumbnails.append(photo)
-            self.image_position_mapping[image_id] = image_path
-
-            x += 110
-            if x > self.root.winfo_width() - 110:
-                x = 10
-                y += 110
-
-    def on_image_click(self, event):
-        clicked_image_id = self.image_canvas.find_closest(event.x, event.y)
-        image_path = self.image_position_mapping.get(clicked_image_id[0])
-
-        if image_path:
-            self.main_app.load_image_from_path(image_path)
+        self.shown_paths = self.image_paths
+        self.thumbnail_grid.set_paths(self.image_paths)
+
+    def toggle_watch(self):
+        if self.watch_folder.get() and self.folder_path:
+            self.start_watching()
+        elif self.watcher is not None:
+            self.watcher.cancel()
+            self.watcher = None
+
+    def start_watching(self):
+        if self.watcher is not None:
+            self.watcher.cancel()
+        # Started with the scan, so files that appear while it runs are reported too
+        self.watcher = FolderWatcher(self.folder_path).start()
+        self.root.after(500, self.poll_watch_results, self.watcher)
+
+    def poll_watch_results(self, watcher):
+        if watcher is not self.watcher:
+            return
+        while True:
+            try:
+                kind, paths = watcher.results.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "removed":
+                self.remove_images(paths)
+            elif kind == "added":
+                self.queue_update(self.add_images(paths))
+            else:
+                # Changed files lose their old faces and thumbnails and are encoded again
+                self.remove_faces(paths)
+                self.thumbnail_grid.forget(paths)
+                self.thumbnail_grid.layout()
+                self.queue_update(paths)
+        self.root.after(500, self.poll_watch_results, watcher)
+
+    def remove_images(self, image_paths):
+        removed = set(image_paths)
+        self.image_paths[:] = [path for path in self.image_paths if path not in removed]
+        self.pending_updates -= removed
+        self.remove_faces(image_paths)
+        self.thumbnail_grid.remove_paths(image_paths)
+
+    def remove_faces(self, image_paths):
+        """Takes images out of the face index and every group, dropping groups left empty."""
+        removed = set(image_paths)
+        self.face_index.remove_paths(removed)
+        for group_name in list(self.groups):
+            self.groups[group_name][:] = [path for path in self.groups[group_name] if path not in removed]
+            if not self.groups[group_name] and group_name in self.group_labels:
+                del self.groups[group_name]
+                del self.group_labels[group_name]
+                self.group_listbox.delete(self.group_listbox.get(0, tk.END).index(group_name))
+
+    def queue_update(self, image_paths):
+        # Only a sorted library has groups to file new faces under; otherwise the next sort picks them up
+        if not image_paths or not self.group_labels and self.pipeline is None:
+            return
+        self.pending_updates.update(image_paths)
+        if self.pipeline is None and self.update_pipeline is None:
+            self.start_update()
+
+    def start_update(self):
+        image_paths, self.pending_updates = sorted(self.pending_updates), set()
+        # A file changed during a full sort was encoded in its old state, drop those faces first
+        self.remove_faces(image_paths)
+        self.update_pipeline = FaceEncodingPipeline(image_paths).start()
+        self.root.after(100, self.poll_update_results, self.update_pipeline)
+
+    def poll_update_results(self, pipeline):
+        if pipeline is not self.update_pipeline:
+            return
+        known = set(self.image_paths)
+        for _ in range(500):
+            try:
+                message = pipeline.results.get_nowait()
+            except queue.Empty:
+                break
+
+            if message[0] == "done":
+                self.update_pipeline = None
+                if self.pending_updates:
+                    self.start_update()
+                return
+            if message[0] == "error":
+                print(f"Could not encode {message[1]}: {message[2]}")
+            elif message[1] in known:  # Skip files deleted while they were encoded
+                _, image_path, face_locations, face_encodings = message
+                face_indices = self.face_index.add(image_path, face_locations, face_encodings)
+                for face_index, face_encoding in zip(face_indices, face_encodings):
+                    self.add_to_person(image_path, face_index, face_encoding)
+        self.root.after(50, self.poll_update_results, pipeline)
+
+    def add_to_person(self, image_path, face_index, face_encoding):
+        """Files one new face under the person with the nearest labelled face, or starts a new group."""
+        label = self.face_index.nearest_person(face_encoding, self.face_clusterer.tolerance)
+        group_names = {label: name for name, label in self.group_labels.items()}
+        if label < 0:
+            label = max(self.group_labels.values(), default=-1) + 1
+            group_names[label] = f"Person_{label + 1}"
+            self.groups[group_names[label]] = []
+            self.group_labels[group_names[label]] = label
+            self.group_listbox.insert(tk.END, group_names[label])
+        self.face_index.labels[face_index] = label
+
+        group = self.groups[group_names[label]]
+        if image_path not in group:
+            group.append(image_path)
+            if self.shown_paths is group:
+                self.thumbnail_grid.add_paths([image_path])
+
+    def on_image_click(self, image_path):
+        # Faces found while sorting are handed to the editor, so the sunglasses filter skips detection
+        faces = [(left, top, right, bottom) for top, right, bottom, left in self.face_index.locations_of(image_path)]
+        self.main_app.load_image_from_path(image_path, faces=faces or None)
 
     def sort_images(self):
         if not self.image_paths:
             messagebox.showwarning("Warning", "No images loaded.")
             return
+        if self.pipeline is not None:
+            return  # Already sorting
+        # Everything is encoded again below, including whatever the watcher had queued
+        if self.update_pipeline is not None:
+            self.update_pipeline.cancel()
+            self.update_pipeline = None
+        self.pending_updates.clear()
 
-        self.known_face_encodings.clear()
-        self.known_face_paths.clear()
+        self.face_index.clear()
         self.groups.clear()
+        self.group_labels.clear()
         self.group_listbox.delete(0, tk.END)
 
-        for image_path in self.image_paths:
-            image = face_recognition.load_image_file(image_path)
-            face_encodings = face_recognition.face_encodings(image)
-            if face_encodings:
-                face_encoding = face_encodings[0]
-                match_found = False
-
-                for i, known_encoding in enumerate(self.known_face_encodings):
-                    match = face_recognition.compare_faces([known_encoding], face_encoding, tolerance=0.6)
-                    if match[0]:
-                        group_name = f"Person_{i+1}"
-                        self.groups[group_name].append(image_path)
-                        match_found = True
-                        break
-
-                if not match_found:
-                    self.known_face_encodings.append(face_encoding)
-                    new_group_index = len(self.known_face_encodings)
-                    group_name = f"Person_{new_group_index}"
-                    self.groups[group_name] = [image_path]
-                    self.group_listbox.insert(tk.END, group_name)
+        # Faces are encoded on a process pool; results come back through a queue polled from the Tk loop
+        self.progress_bar.config(maximum=len(self.image_paths), value=0)
+        self.cancel_sort_button.config(state="normal")
+        self.pipeline = FaceEncodingPipeline(sorted(self.image_paths)).start()
+        self.root.after(100, self.poll_sort_results)
+
+    def cancel_sort(self):
+        if self.pipeline is not None:
+            self.pipeline.cancel()
+
+    def poll_sort_results(self):
+        # Bounded per tick, so a burst of cached results doesn't freeze the window
+        for _ in range(500):
+            try:
+                message = self.pipeline.results.get_nowait()
+            except queue.Empty:
+                break
+
+            if message[0] == "done":
+                self.finish_sort(cancelled=message[1])
+                return
+            if message[0] == "error":
+                print(f"Could not encode {message[1]}: {message[2]}")
+            else:
+                _, image_path, face_locations, face_encodings = message
+                self.face_index.add(image_path, face_locations, face_encodings)
+                for face_encoding in face_encodings:
+                    self.add_to_nearest_group(image_path, face_encoding)
+            self.progress_bar.step(1)
+        self.root.after(50, self.poll_sort_results)
+
+    def add_to_nearest_group(self, image_path, face_encoding):
+        """Files an image under the closest group so far, so the listbox fills in while encoding runs."""
+        if self.group_centers:
+            distances = np.linalg.norm(np.array(self.group_centers) - face_encoding, axis=1)
+            best = int(np.argmin(distances))
+            if distances[best] <= self.face_clusterer.tolerance:
+                # By position, not name: a group can be renamed while the sort is running
+                group = self.streaming_groups[best]
+                # Two faces of one image can match the same group; the watcher can empty a group mid-sort
+                if not group or group[-1] != image_path:
+                    group.append(image_path)
+                return
+
+        self.group_centers.append(face_encoding)
+        self.streaming_groups.append([image_path])
+        group_name = f"Person_{len(self.group_centers)}"
+        self.groups[group_name] = self.streaming_groups[-1]
+        self.group_listbox.insert(tk.END, group_name)
+
+    def finish_sort(self, cancelled):
+        self.pipeline = None
+        self.group_centers.clear()
+        self.streaming_groups.clear()
+        self.cancel_sort_button.config(state="disabled")
+        if cancelled:
+            self.pending_updates.clear()
+            messagebox.showinfo("Cancelled", f"Sorting cancelled, {len(self.face_index)} faces grouped so far.")
+            return
+
+        # All encodings are clustered at once, so the final groups don't depend on the order results arrived in
+        self.face_index.sort_by_path()
+        labels = self.face_clusterer.cluster(self.face_index.get_encodings())
+        self.face_index.set_labels(labels)
+
+        # Every face is clustered, so a group photo is listed under each person in it
+        self.groups.clear()
+        self.group_labels.clear()
+        self.group_listbox.delete(0, tk.END)
+        for label in range(int(labels.max()) + 1 if len(labels) else 0):
+            group_name = f"Person_{label + 1}"
+            self.groups[group_name] = self.face_index.images_of(label)
+            self.group_labels[group_name] = label
+            self.group_listbox.insert(tk.END, group_name)
 
         messagebox.showinfo("Success", "Images sorted into groups by faces.")
+        if self.pending_updates:
+            self.start_update()  # Files the watcher reported while sorting
 
     def display_group_images(self, event):
         selection = self.group_listbox.curselection()
         if selection:
             group_name = self.group_listbox.get(selection[0])
-            self.image_canvas.delete("all")
-            self.thumbnails.clear()
-
-            x, y = 10, 10
-            for image_path in self.groups.get(group_name, []):
-                image = Image.open(image_path)
-                image.thumbnail((100, 100))
-                photo = ImageTk.PhotoImage(image)
-                image_id = self.image_canvas.create_image(x, y, anchor="nw", image=photo)
-                self.thumbnails.append(photo)
-                self.image_position_mapping[image_id] = image_path
-                x += 110
-                if x > self.root.winfo_width() - 110:
-                    x = 10
-                    y += 110
+            self.shown_paths = self.groups.get(group_name)
+            self.thumbnail_grid.set_paths(self.groups.get(group_name, []))
+
+    def find_person(self):
+        """Shows every image with a face close to the selected person, including ones clustering left out."""
+        selection = self.group_listbox.curselection()
+        if not selection:
+            messagebox.showwarning("Warning", "Select a group first.")
+            return
+        label = self.group_labels.get(self.group_listbox.get(selection[0]))
+        center = self.face_index.person_center(label) if label is not None else None
+        if center is None:
+            messagebox.showwarning("Warning", "Sort the images before searching for a person.")
+            return
+        self.shown_paths = None
+        self.thumbnail_grid.set_paths(self.face_index.images_matching(center, self.face_clusterer.tolerance))
 
     def rename_group(self, event):
         selection = self.group_listbox.curselection()
@@ -140,20 +363,40 @@ class ImagePlannerApp:
             new_name = simpledialog.askstring("Rename Group", f"Enter new name for {group_name}:")
             if new_name:
                 self.groups[new_name] = self.groups.pop(group_name)
+                if group_name in self.group_labels:
+                    self.group_labels[new_name] = self.group_labels.pop(group_name)
                 self.group_listbox.delete(selection[0])
                 self.group_listbox.insert(selection[0], new_name)
                 messagebox.showinfo("Success", f"Group renamed to '{new_name}'.")
 
     def download_sorted_folders(self):
+        if self.export is not None:
+            return  # Already exporting
         output_folder = filedialog.askdirectory(title="Select Folder to Save Sorted Groups")
         if output_folder:
-            for group_name, image_paths in self.groups.items():
-                group_folder = os.path.join(output_folder, group_name)
-                os.makedirs(group_folder, exist_ok=True)
-                for image_path in image_paths:
-                    shutil.copy(image_path, group_folder)
-            messagebox.showinfo("Success", f"Sorted folders downloaded to '{output_folder}'.")
+            # The export runs on worker threads, so it gets its own copy of the groups
+            groups = {group_name: list(image_paths) for group_name, image_paths in self.groups.items()}
+            self.export = FolderExport(groups, output_folder, mode=self.export_mode.get()).start()
+            self.download_folders_button.config(state="disabled")
+            self.root.after(100, self.poll_export_results, output_folder)
 
+    def poll_export_results(self, output_folder):
+        while True:
+            try:
+                message = self.export.results.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == "progress":
+                _, done_files, total_files, _ = message
+                self.progress_bar.config(maximum=max(total_files, 1), value=done_files)
+            elif message[0] == "error":
+                print(f"Could not export {message[1]}: {message[2]}")
+            else:
+                self.export = None
+                self.download_folders_button.config(state="normal")
+                messagebox.showinfo("Success", f"Sorted folders downloaded to '{output_folder}'.")
+                return
+        self.root.after(100, self.poll_export_results, output_folder)
 
 if __name__ == "__main__":
     root = tk.Tk()
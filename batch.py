@@ -0,0 +1,239 @@
+"""
+Applies the editor's filters to many images without a display.
+
+    python batch.py photos/ out/ --pipeline "blur k=7, sharpen, sunglasses, resize 0.5"
+    python batch.py "photos/**/*.jpg" out/ --pipeline "rotate 90" --workers 8
+    python batch.py photos/ out/ --pipeline "median 5, unsharp sigma=3 amount=0.8, curves 50 128 210"
+
+Steps run left to right. Output files keep their path relative to the input
+folder (or to the part of a glob before the first wildcard).
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import cv2
+import numpy as np
+from PIL import Image
+from filter import FILTERS, Filter
+from folder_scanner import IMAGE_EXTENSIONS
+
+
+def blur_step(image, k=5):
+    return Filter().apply_blur(image, (int(k), int(k)))
+
+
+def sharpen_step(image):
+    return Filter().apply_sharpen(image)
+
+
+_sunglasses_filter = None
+
+
+def sunglasses_step(image):
+    # dlib and its landmark model are loaded once per worker process, on first use
+    global _sunglasses_filter
+    if _sunglasses_filter is None:
+        from facial_recognition import SunglassesFilter
+        _sunglasses_filter = SunglassesFilter()
+    image_cv = cv2.cvtColor(np.array(image), cv2.COLOR_RGBA2BGR)
+    image = image.copy()
+    for x, y, patch in _sunglasses_filter.render_patches(image_cv):
+        image.alpha_composite(patch, (x, y))
+    return image
+
+
+def resize_step(image, factor=1.0):
+    factor = float(factor)
+    size = (max(1, round(image.width * factor)), max(1, round(image.height * factor)))
+    return image.resize(size, Image.LANCZOS)
+
+
+def rotate_step(image, angle=0.0):
+    # Expands the canvas so the rotated image isn't cropped, like rotating a layer in the editor
+    return image.rotate(float(angle), resample=Image.BICUBIC, expand=True)
+
+
+# Steps that Filter.apply_pipeline can run: consecutive ones share one PIL <-> NumPy round trip
+FILTER_OPERATIONS = {
+    "blur": lambda k=5: ("blur", {"kernel_size": (int(k), int(k))}),
+    "sharpen": lambda: "sharpen",
+}
+
+# Step name -> (function, {parameter name: type}) with the parameters in positional order
+STEPS = {
+    "blur": (blur_step, {"k": int}),
+    "sharpen": (sharpen_step, {}),
+    "sunglasses": (sunglasses_step, {}),
+    "resize": (resize_step, {"factor": float}),
+    "rotate": (rotate_step, {"angle": float}),
+}
+
+# Every other registered filter is a step too, with the registry's parameter names
+for _name, _kernel in FILTERS.items():
+    if _name not in STEPS:
+        STEPS[_name] = (None, {name: type(default) for name, default, _, _ in _kernel.parameters})
+        FILTER_OPERATIONS[_name] = lambda _kernel=_kernel, **keywords: (_kernel.name, _kernel.convert(keywords))
+
+
+def parse_pipeline(spec):
+    """
+    Parses a pipeline spec such as "blur k=7, sharpen, resize 0.5".
+
+    Returns:
+    - A list of (step name, keyword arguments), with every argument
+      converted to its parameter's type.
+
+    Raises ValueError for unknown steps or parameters, or values of the wrong type.
+    """
+    pipeline = []
+    for part in spec.split(","):
+        tokens = part.split()
+        if not tokens:
+            continue
+        name, arguments = tokens[0].lower(), tokens[1:]
+        if name not in STEPS:
+            raise ValueError(f"Unknown step {name!r}, expected one of {', '.join(STEPS)}")
+        parameters = STEPS[name][1]
+        keywords = {}
+        for position, argument in enumerate(arguments):
+            key, separator, value = argument.partition("=")
+            if not separator:
+                if position >= len(parameters):
+                    raise ValueError(f"Too many arguments for {name}")
+                key, value = list(parameters)[position], argument
+            if key not in parameters:
+                raise ValueError(f"Unknown parameter {key!r} for {name}")
+            # Converted here, so a bad value fails once rather than in a worker for every image
+            try:
+                keywords[key] = parameters[key](value)
+            except ValueError:
+                raise ValueError(f"{name} {key} must be {'an integer' if parameters[key] is int else 'a number'}, "
+                                 f"got {value!r}") from None
+        pipeline.append((name, keywords))
+    if not pipeline:
+        raise ValueError("The pipeline is empty")
+    return pipeline
+
+
+def process_image(pipeline, input_path, output_path):
+    """Runs in a worker process. Returns (input_path, error message or None)."""
+    try:
+        with Image.open(input_path) as source:
+            image = source.convert("RGBA")
+        operations = []
+        for name, keywords in pipeline:
+            if name in FILTER_OPERATIONS:
+                operations.append(FILTER_OPERATIONS[name](**keywords))
+                continue
+            if operations:
+                image = Filter().apply_pipeline(image, operations)
+                operations = []
+            image = STEPS[name][0](image, **keywords)
+        if operations:
+            image = Filter().apply_pipeline(image, operations)
+
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        if os.path.splitext(output_path)[1].lower() in (".jpg", ".jpeg", ".bmp"):
+            image = image.convert("RGB")  # No alpha channel in these formats
+        image.save(output_path)
+        return input_path, None
+    except Exception as error:
+        return input_path, f"{type(error).__name__}: {error}"
+
+
+def find_inputs(source):
+    """Yields (input_path, path relative to the input root) for a folder or a glob pattern."""
+    if os.path.isdir(source):
+        for root, directories, files in os.walk(source):
+            directories.sort()
+            for file in sorted(files):
+                if file.lower().endswith(IMAGE_EXTENSIONS):
+                    input_path = os.path.join(root, file)
+                    yield input_path, os.path.relpath(input_path, source)
+        return
+
+    root = source
+    while glob.has_magic(root):
+        root = os.path.dirname(root)
+    for input_path in glob.iglob(source, recursive=True):
+        if os.path.isfile(input_path):
+            yield input_path, os.path.relpath(input_path, root or ".")
+
+
+def run_batch(source, output_folder, pipeline, workers=None, max_pending=None, overwrite=False, report=print):
+    """
+    Processes every image under source on a process pool.
+
+    At most max_pending images are queued or in flight at once, so memory use
+    stays flat however many files there are. Outputs newer than their input
+    are skipped unless overwrite is set.
+
+    Returns:
+    - (processed, skipped, failed) counts.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers * 2
+    processed = skipped = failed = 0
+    started = time.perf_counter()
+    inputs = find_inputs(source)
+    pending = set()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            for input_path, relative_path in inputs:
+                output_path = os.path.join(output_folder, relative_path)
+                if (not overwrite and os.path.exists(output_path)
+                        and os.path.getmtime(output_path) >= os.path.getmtime(input_path)):
+                    skipped += 1
+                    continue
+                pending.add(pool.submit(process_image, pipeline, input_path, output_path))
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                input_path, error = future.result()
+                if error is None:
+                    processed += 1
+                else:
+                    failed += 1
+                    report(f"Failed {input_path}: {error}")
+                if (processed + failed) % 100 == 0:
+                    elapsed = time.perf_counter() - started
+                    report(f"{processed + failed} images, {(processed + failed) / elapsed:.1f}/s")
+
+    return processed, skipped, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply editor filters to many images without a display.")
+    parser.add_argument("source", help="Input folder, or a glob pattern such as 'photos/**/*.jpg'")
+    parser.add_argument("output", help="Folder to write results to")
+    parser.add_argument("--pipeline", required=True,
+                        help=f"Comma separated steps, e.g. 'blur k=7, sharpen, resize 0.5'. Steps: {', '.join(STEPS)}")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU)")
+    parser.add_argument("--max-pending", type=int, default=None,
+                        help="Images queued or in flight at once (default: twice the workers)")
+    parser.add_argument("--overwrite", action="store_true", help="Redo outputs that are newer than their input")
+    args = parser.parse_args(argv)
+
+    try:
+        pipeline = parse_pipeline(args.pipeline)
+    except ValueError as error:
+        parser.error(str(error))
+
+    report = lambda message: print(message, file=sys.stderr)
+    started = time.perf_counter()
+    processed, skipped, failed = run_batch(args.source, args.output, pipeline, args.workers, args.max_pending,
+                                           args.overwrite, report)
+    report(f"Done in {time.perf_counter() - started:.1f}s: {processed} processed, {skipped} skipped, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""
+Compares the Gaussian blur methods in filter.py across blur radii.
+
+    python bench_blur.py photo.jpg --sigmas 2 4 8 16 32 64
+
+Without an image a synthetic 12 MP RGBA image is used. For every sigma the
+script prints each method's best time, its speedup over the direct blur and
+its PSNR against a float32 reference blur. "auto" is what Filter uses.
+"""
+import argparse
+import math
+import time
+import cv2
+import numpy as np
+from filter import BLUR_METHODS, blur_method
+
+
+def synthetic_image(width, height, seed=0):
+    """Flat blocks with hard edges plus fine noise, the two things blurs get wrong."""
+    rng = np.random.default_rng(seed)
+    blocks = rng.integers(0, 216, (height // 40 + 1, width // 40 + 1, 4), dtype=np.uint8)
+    image = cv2.resize(blocks, (width, height), interpolation=cv2.INTER_NEAREST)
+    return cv2.add(image, rng.integers(0, 40, image.shape, dtype=np.uint8))
+
+
+def psnr(image, reference):
+    mse = np.mean((image.astype(np.float64) - reference) ** 2)
+    return float("inf") if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+def best_time(function, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("image", nargs="?")
+    parser.add_argument("--sigmas", type=float, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.image:
+        image = cv2.imread(args.image, cv2.IMREAD_UNCHANGED)
+        if image is None:
+            parser.error(f"Could not read {args.image}")
+        if image.ndim == 2 or image.shape[2] == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGRA if image.ndim == 2 else cv2.COLOR_BGR2BGRA)
+    else:
+        image = synthetic_image(4000, 3000)
+    print(f"{image.shape[1]}x{image.shape[0]} RGBA, best of {args.repeats}\n")
+
+    methods = list(BLUR_METHODS) + ["auto"]
+    print(f"{'sigma':>6} {'method':>12} {'time ms':>9} {'speedup':>8} {'PSNR dB':>8}")
+    target = np.empty_like(image)
+    for sigma in args.sigmas:
+        reference = cv2.GaussianBlur(image.astype(np.float32), (0, 0), sigma)
+        direct_time = None
+        for method in methods:
+            function = BLUR_METHODS[blur_method(sigma) if method == "auto" else method]
+            seconds = best_time(lambda: function(image, target, sigma), args.repeats)
+            direct_time = direct_time or seconds
+            label = f"auto={blur_method(sigma)}" if method == "auto" else method
+            print(f"{sigma:>6g} {label:>12} {seconds * 1000:>9.1f} {direct_time / seconds:>7.1f}x "
+                  f"{psnr(target, reference):>8.1f}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
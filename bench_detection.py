@@ -0,0 +1,91 @@
+"""
+Compares face detection on shrunk copies against full-resolution detection.
+
+    python bench_detection.py photo1.jpg photo2.jpg --sizes 0 2048 1024 640 --upsample 0 1
+
+Size 0 is the full-resolution baseline. For every setting the script prints
+the mean detection time and its speedup over the baseline, how many of the
+baseline's faces were found, and the mean landmark error. The error is in
+pixels and relative to the inter-ocular distance, measured against the
+landmarks predicted from the baseline boxes.
+"""
+import argparse
+import time
+import cv2
+import numpy as np
+from face_analysis import DEFAULT_PREDICTOR_PATH, FaceAnalysisService
+
+
+def box_overlap(a, b):
+    """Intersection over union of two (left, top, right, bottom) boxes."""
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    area = lambda box: (box[2] - box[0]) * (box[3] - box[1])
+    return intersection / (area(a) + area(b) - intersection)
+
+
+def analyse(service, image, repeats):
+    """Returns (faces, landmarks, best detection time in seconds) without using the service's cache."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        faces = service.run_detector(image)
+        best = min(best, time.perf_counter() - start)
+    return faces, [service.predict_landmarks(image, face) for face in faces], best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[0, 2048, 1024, 640],
+                        help="Longest side to detect at, 0 for full resolution")
+    parser.add_argument("--upsample", type=int, nargs="+", default=[0, 1])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--predictor", default=DEFAULT_PREDICTOR_PATH)
+    args = parser.parse_args(argv)
+
+    images = [(path, cv2.imread(path)) for path in args.images]
+    images = [(path, image) for path, image in images if image is not None]
+    baseline_service = FaceAnalysisService(args.predictor)
+    baseline_service.load_models()
+    baselines = [analyse(baseline_service, image, args.repeats) for _, image in images]
+    baseline_time = sum(result[2] for result in baselines)
+    print(f"{len(images)} images, {sum(len(result[0]) for result in baselines)} faces at full resolution, "
+          f"{baseline_time * 1000:.0f} ms\n")
+
+    print(f"{'max side':>8} {'upsample':>8} {'time ms':>9} {'speedup':>8} {'faces':>7} {'error px':>9} {'error iod':>9}")
+    for size in args.sizes:
+        for upsample in args.upsample:
+            service = FaceAnalysisService(args.predictor, detect_max_side=size or None, upsample=upsample)
+            service.face_detector = baseline_service.face_detector
+            service.landmark_predictor = baseline_service.landmark_predictor
+
+            total_time, found, errors, relative_errors = 0.0, 0, [], []
+            for (_, image), (base_faces, base_landmarks, _) in zip(images, baselines):
+                faces, landmarks, seconds = analyse(service, image, args.repeats)
+                total_time += seconds
+                for base_face, base_points in zip(base_faces, base_landmarks):
+                    # Match each baseline face to the detected face overlapping it most
+                    overlaps = [box_overlap(base_face, face) for face in faces]
+                    if not overlaps or max(overlaps) < 0.5:
+                        continue
+                    points = landmarks[int(np.argmax(overlaps))]
+                    if points is None or base_points is None:
+                        continue
+                    found += 1
+                    error = np.linalg.norm(points - base_points, axis=1).mean()
+                    inter_ocular = np.linalg.norm(base_points[36:42].mean(axis=0) - base_points[42:48].mean(axis=0))
+                    errors.append(error)
+                    relative_errors.append(error / max(inter_ocular, 1e-6))
+
+            total_faces = sum(len(result[0]) for result in baselines)
+            print(f"{size or 'full':>8} {upsample:>8} {total_time * 1000:>9.0f} {baseline_time / total_time:>7.1f}x "
+                  f"{found:>3}/{total_faces:<3} {np.mean(errors) if errors else float('nan'):>9.2f} "
+                  f"{np.mean(relative_errors) if relative_errors else float('nan'):>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import math
+import queue
+import threading
+from filter import Filter, gaussian_sigma
+from tiled_image import TiledImage
+
+
+def blur_tiles(tiles, strength):
+    """Blurs a TiledImage at full resolution with a (2 * strength + 1) Gaussian kernel, tiles in parallel."""
+    return Filter().apply_tiled(tiles, [("blur", {"kernel_size": strength * 2 + 1})])
+
+
+def proxy_level(size, display_scale, max_side):
+    """
+    Pyramid level to preview a layer at.
+
+    Parameters:
+    - size: (width, height) of the layer's stored pixels.
+    - display_scale: Scale the layer is drawn at.
+    - max_side: Longest side worth computing, usually the screen size.
+
+    Returns:
+    - The highest level whose longest side is still at least the displayed size, capped at max_side.
+    """
+    longest = max(size)
+    target = max(1.0, min(longest * display_scale, max_side))
+    return max(0, int(math.floor(math.log2(longest / target))))
+
+
+class BlurPreview:
+    """
+    Computes blur previews for one layer on a worker thread.
+
+    Previews are blurred from `proxy`, a copy of the layer shrunk by
+    `scale`, with sigma scaled to match, so moving the slider costs about
+    the same on a 40 MP layer as on a screen-sized one. Only the newest
+    request is kept: one made while another is running replaces any waiting
+    request, and results of superseded previews are dropped. The full
+    resolution blur runs only for apply().
+
+    Results are put on `results` as ("preview", strength, TiledImage),
+    ("final", strength, TiledImage) or ("error", message).
+    """
+
+    def __init__(self, tiles, proxy, scale):
+        self.tiles = tiles
+        self.proxy = proxy
+        self.proxy_image = None  # Made on the worker thread on first use
+        self.scale = scale
+        self.results = queue.Queue()
+        self.cancelled = threading.Event()
+        self.condition = threading.Condition()
+        self.pending = None  # ("preview" or "final", strength) waiting to run
+        self.generation = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        with self.condition:
+            self.cancelled.set()
+            self.condition.notify()
+
+    def request(self, strength):
+        self.submit(("preview", strength))
+
+    def apply(self, strength):
+        self.submit(("final", strength))
+
+    def cancel_pending(self):
+        """Drops the waiting request and marks the running one stale, without starting another."""
+        with self.condition:
+            self.pending = None
+            self.generation += 1
+
+    def submit(self, job):
+        with self.condition:
+            self.pending = job
+            self.generation += 1
+            self.condition.notify()
+
+    def is_current(self, generation):
+        with self.condition:
+            return generation == self.generation and not self.cancelled.is_set()
+
+    def blur_proxy(self, strength):
+        if self.proxy_image is None:
+            self.proxy_image = self.proxy.to_image()
+        sigma = gaussian_sigma(strength * 2 + 1) * self.scale
+        blurred = Filter().apply_pipeline(self.proxy_image, [("blur", {"kernel_size": (0, 0), "sigma": sigma})])
+        return TiledImage.from_image(blurred)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.cancelled.is_set():
+                    self.condition.wait()
+                if self.cancelled.is_set():
+                    return
+                (kind, strength), generation = self.pending, self.generation
+                self.pending = None
+
+            try:
+                if kind == "preview":
+                    result = self.blur_proxy(strength)
+                else:
+                    result = blur_tiles(self.tiles, strength)
+            except Exception as error:
+                self.results.put(("error", str(error)))
+                continue
+            if kind == "final" and not self.cancelled.is_set() or self.is_current(generation):
+                self.results.put((kind, strength, result))
@@ -0,0 +1,236 @@
+import math
+import numpy as np
+from PIL import Image
+from layer import compose_transforms, transform_points
+from lazy_import import lazy_module
+
+cv2 = lazy_module("cv2")
+
+
+class LayerCompositor:
+    """
+    Flattens a layer stack for display.
+
+    Only the visible part of the canvas (the viewport) is rendered. Each layer
+    is drawn from the pyramid level closest to its displayed scale, and only
+    the tiles intersecting the viewport are read, so the cost of a redraw
+    depends on the window size rather than the image size. A transformed
+    layer is resampled here, with one warpAffine over the visible part.
+
+    The layers below and above the active layer are flattened once and cached,
+    so an event that only touches the active layer (translate, scale, filter
+    preview) re-blends three images instead of every layer in the stack.
+    A cache entry is thrown away as soon as the viewport or the image, offset,
+    transform or visibility of any layer it covers changes.
+
+    The last flattened frame is kept as well; when only a few boxes of the
+    active layer changed, update_regions re-blends just those boxes.
+    """
+
+    def __init__(self):
+        self.below = None  # (signature, image, origin)
+        self.above = None
+        self.frame = None
+        self.frame_box = None
+        self.frame_layer = None
+
+    @staticmethod
+    def layer_signature(layer):
+        x_offset, y_offset = layer.get_offset()
+        return layer.version, layer.visible, int(x_offset), int(y_offset), tuple(layer.transform.ravel())
+
+    @staticmethod
+    def layer_box(layer):
+        return layer.get_box()
+
+    @staticmethod
+    def union_box(boxes):
+        boxes = [box for box in boxes if box is not None]
+        if not boxes:
+            return None
+        return (min(box[0] for box in boxes), min(box[1] for box in boxes),
+                max(box[2] for box in boxes), max(box[3] for box in boxes))
+
+    @staticmethod
+    def intersect_box(*boxes):
+        boxes = [box for box in boxes if box is not None]
+        box = (max(box[0] for box in boxes), max(box[1] for box in boxes),
+               min(box[2] for box in boxes), min(box[3] for box in boxes))
+        if box[0] >= box[2] or box[1] >= box[3]:
+            return None
+        return box
+
+    def extent(self, layers):
+        """Canvas box covered by all visible layers, or None."""
+        return self.union_box(self.layer_box(layer) for layer in layers if layer.visible and layer.has_image())
+
+    def render_layer(self, layer, target, origin, box=None, interpolation=None):
+        """
+        Blends one layer into an image.
+
+        Parameters:
+        - layer: Layer to draw, at its offset and transform.
+        - target: PIL RGBA image to draw into.
+        - origin: Canvas position of target's top-left corner.
+        - box: Optional canvas box to limit the work to.
+        - interpolation: OpenCV interpolation used when the layer is transformed,
+          INTER_LINEAR by default.
+        """
+        layer_box = self.layer_box(layer)
+        target_box = (origin[0], origin[1], origin[0] + target.width, origin[1] + target.height)
+        box = self.intersect_box(layer_box, target_box, box)
+        if box is None:
+            return
+
+        x_offset, y_offset = (int(v) for v in layer.get_offset())
+        if not layer.has_transform():
+            layer.get_tiles().composite_onto(
+                target, dest=(x_offset - origin[0], y_offset - origin[1]),
+                box=(box[0] - x_offset, box[1] - y_offset, box[2] - x_offset, box[3] - y_offset)
+            )
+            return
+
+        # Read the nearest pyramid level, then map the part under the box with a single warp
+        level = layer.level_for_scale(layer.get_scale())
+        source = layer.get_level(level)
+        to_canvas = compose_transforms(
+            np.array([[1.0, 0.0, x_offset], [0.0, 1.0, y_offset]]),
+            compose_transforms(layer.transform, np.array([[2.0 ** level, 0.0, 0.0], [0.0, 2.0 ** level, 0.0]]))
+        )
+        corners = transform_points(cv2.invertAffineTransform(to_canvas),
+                                   [(box[0], box[1]), (box[2], box[1]), (box[0], box[3]), (box[2], box[3])])
+        u1 = max(int(math.floor(corners[:, 0].min())) - 1, 0)
+        v1 = max(int(math.floor(corners[:, 1].min())) - 1, 0)
+        u2 = min(int(math.ceil(corners[:, 0].max())) + 1, source.width)
+        v2 = min(int(math.ceil(corners[:, 1].max())) + 1, source.height)
+        if u1 >= u2 or v1 >= v2:
+            return
+
+        to_box = compose_transforms(
+            np.array([[1.0, 0.0, -box[0]], [0.0, 1.0, -box[1]]]),
+            compose_transforms(to_canvas, np.array([[1.0, 0.0, u1], [0.0, 1.0, v1]]))
+        )
+        if interpolation is None:
+            interpolation = cv2.INTER_LINEAR
+        patch = cv2.warpAffine(np.asarray(source.crop((u1, v1, u2, v2))), to_box, (box[2] - box[0], box[3] - box[1]),
+                               flags=interpolation, borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0, 0))
+        target.alpha_composite(Image.fromarray(patch, "RGBA"), dest=(box[0] - origin[0], box[1] - origin[1]))
+
+    def flatten(self, layers, box):
+        """
+        Blends the given layers into one image covering a canvas box.
+
+        Returns:
+        - A PIL RGBA image of the box, or None if none of the layers is visible.
+        """
+        visible = [layer for layer in layers if layer.visible and layer.has_image()]
+        if not visible:
+            return None
+
+        flattened = Image.new("RGBA", (box[2] - box[0], box[3] - box[1]), (0, 0, 0, 0))
+        for layer in visible:
+            self.render_layer(layer, flattened, box[:2])
+        return flattened
+
+    def cached_flatten(self, cache, layers, box):
+        signature = (box,) + tuple(self.layer_signature(layer) for layer in layers)
+        if cache is not None and cache[0] == signature:
+            return cache
+        return signature, self.flatten(layers, box), box[:2]
+
+    def invalidate(self):
+        self.below = None
+        self.above = None
+        self.frame = None
+
+    def frame_box_for(self, layers, viewport):
+        extent = self.extent(layers)
+        if extent is None:
+            return None
+        return self.intersect_box(extent, viewport)
+
+    def composite(self, layers, active_index, viewport=None):
+        """
+        Returns the visible part of the stack flattened as (image, origin),
+        or (None, None) if nothing is visible. The result is kept as the
+        current frame, so later events can re-blend parts of it with
+        update_regions.
+
+        Parameters:
+        - layers: Layer stack, bottom first.
+        - active_index: Index of the layer being edited, or -1.
+        - viewport: Canvas box currently on screen. Defaults to the whole stack.
+        """
+        self.frame = None
+        self.frame_layer = None
+        box = self.frame_box_for(layers, viewport)
+        if box is None:
+            return None, None
+
+        frame = Image.new("RGBA", (box[2] - box[0], box[3] - box[1]), (0, 0, 0, 0))
+        if not 0 <= active_index < len(layers):
+            self.below = self.cached_flatten(self.below, layers, box)
+            self.above = None
+            if self.below[1] is not None:
+                frame.alpha_composite(self.below[1])
+        else:
+            self.below = self.cached_flatten(self.below, layers[:active_index], box)
+            self.above = self.cached_flatten(self.above, layers[active_index + 1:], box)
+            self.frame_layer = layers[active_index]
+            if self.below[1] is not None:
+                frame.alpha_composite(self.below[1])
+            if self.frame_layer.visible and self.frame_layer.has_image():
+                self.render_layer(self.frame_layer, frame, box[:2])
+            if self.above[1] is not None:
+                frame.alpha_composite(self.above[1])
+
+        self.frame = frame
+        self.frame_box = box
+        return frame, (box[0], box[1])
+
+    def update_regions(self, layers, active_index, boxes, viewport=None):
+        """
+        Re-blends only the damaged parts of the current frame.
+
+        Parameters:
+        - layers: The layer stack the frame was built from.
+        - active_index: Index of the active layer. Only the active layer may
+          have changed since the frame was built.
+        - boxes: Damaged (x1, y1, x2, y2) boxes in canvas coordinates.
+        - viewport: Canvas box currently on screen, as given to composite.
+
+        Returns:
+        - A list of (region_image, (x, y)) pairs, positioned relative to the
+          frame's top-left corner, or None if the frame has to be rebuilt with
+          composite (a cached stack or the visible box changed).
+        """
+        if self.frame is None or not 0 <= active_index < len(layers):
+            return None
+        active_layer = layers[active_index]
+        if active_layer is not self.frame_layer:
+            return None
+        box = self.frame_box_for(layers, viewport)
+        if box != self.frame_box:
+            return None
+        if (self.below[0] != (box,) + tuple(self.layer_signature(layer) for layer in layers[:active_index])
+                or self.above[0] != (box,) + tuple(self.layer_signature(layer) for layer in layers[active_index + 1:])):
+            return None
+
+        regions = []
+        for damaged in boxes:
+            x1, y1 = max(int(damaged[0]), box[0]), max(int(damaged[1]), box[1])
+            x2, y2 = min(int(damaged[2]) + 1, box[2]), min(int(damaged[3]) + 1, box[3])
+            if x1 >= x2 or y1 >= y2:
+                continue
+
+            source = (x1 - box[0], y1 - box[1], x2 - box[0], y2 - box[1])
+            region = Image.new("RGBA", (x2 - x1, y2 - y1), (0, 0, 0, 0))
+            if self.below[1] is not None:
+                region.alpha_composite(self.below[1], source=source)
+            if active_layer.visible and active_layer.has_image():
+                self.render_layer(active_layer, region, (x1, y1))
+            if self.above[1] is not None:
+                region.alpha_composite(self.above[1], source=source)
+            self.frame.paste(region, source[:2])
+            regions.append((region, source[:2]))
+        return regions
@@ -0,0 +1,84 @@
+import json
+import os
+import sqlite3
+import numpy as np
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "ikt213", "face_encodings.sqlite")
+
+# Bumped whenever cached locations stop matching what the encoder produces; older tables are dropped.
+# 2: images are rotated by their EXIF orientation before encoding.
+CACHE_VERSION = 2
+
+
+class FaceEncodingCache:
+    """
+    On-disk cache of face locations and encodings, keyed by file path, mtime
+    and size. An entry is only used while the file on disk still has the
+    same mtime and size, so edited or replaced photos are encoded again.
+
+    SQLite connections belong to the thread that opened them, so create the
+    cache on the thread that uses it.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] < CACHE_VERSION:
+            self.connection.execute("DROP TABLE IF EXISTS faces")
+            self.connection.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS faces ("
+            "path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, locations TEXT, encodings BLOB)"
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def file_key(image_path):
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def get_many(self, image_paths, chunk_size=500):
+        """
+        Looks up many images at once.
+
+        Returns:
+        - A dict of path -> (face_locations, face_encodings) for every image
+          whose cached entry is still valid.
+        """
+        found = {}
+        image_paths = list(image_paths)
+        for start in range(0, len(image_paths), chunk_size):
+            chunk = image_paths[start:start + chunk_size]
+            rows = self.connection.execute(
+                f"SELECT path, mtime_ns, size, locations, encodings FROM faces WHERE path IN ({','.join('?' * len(chunk))})",
+                chunk
+            )
+            for image_path, mtime_ns, size, locations, encodings in rows:
+                if self.file_key(image_path) != (mtime_ns, size):
+                    continue
+                found[image_path] = ([tuple(location) for location in json.loads(locations)],
+                                     np.frombuffer(encodings, dtype=np.float64).reshape(-1, 128))
+        return found
+
+    def put_many(self, entries):
+        """Stores (path, face_locations, face_encodings) entries in one transaction."""
+        rows = []
+        for image_path, face_locations, face_encodings in entries:
+            key = self.file_key(image_path)
+            if key is None:
+                continue
+            rows.append((image_path, key[0], key[1], json.dumps([list(location) for location in face_locations]),
+                         np.ascontiguousarray(face_encodings, dtype=np.float64).tobytes()))
+        self.connection.executemany("INSERT OR REPLACE INTO faces VALUES (?, ?, ?, ?, ?)", rows)
+        self.connection.commit()
+
+    def remove(self, image_paths):
+        self.connection.executemany("DELETE FROM faces WHERE path = ?", [(path,) for path in image_paths])
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
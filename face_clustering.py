@@ -0,0 +1,145 @@
+import numpy as np
+
+
+class FaceClusterer:
+    """
+    Groups 128-d face encodings with Chinese Whispers.
+
+    Each face is linked to at most `neighbors` of its nearest faces within
+    tolerance (the same distance rule as face_recognition.compare_faces),
+    found block by block, so the graph grows with the number of faces rather
+    than with the square of the largest cluster. Labels are then propagated
+    over that graph. Nodes are updated in a seeded random order, so the
+    result only depends on the set of encodings and their order in the
+    input, not on how many were processed before.
+    """
+
+    def __init__(self, tolerance=0.6, block_size=2048, iterations=100, seed=0, neighbors=10):
+        self.tolerance = tolerance
+        self.block_size = block_size
+        self.iterations = iterations
+        self.seed = seed
+        self.neighbors = neighbors
+
+    def nearest(self, encodings):
+        """
+        Finds the `neighbors` nearest other faces of every face.
+
+        Returns:
+        - (indices, squared_distances), both (N, k) arrays with k at most
+          `neighbors`. Rows are not sorted.
+        """
+        encodings = np.asarray(encodings, dtype=np.float32)
+        norms = np.einsum("ij,ij->i", encodings, encodings)
+        count = len(encodings)
+        k = min(self.neighbors, count - 1)
+        indices = np.empty((count, k), dtype=np.int32)
+        distances = np.empty((count, k), dtype=np.float32)
+
+        for start in range(0, count, self.block_size):
+            block = encodings[start:start + self.block_size]
+            best_indices = np.full((len(block), 0), -1, dtype=np.int32)
+            best_distances = np.zeros((len(block), 0), dtype=np.float32)
+            for other_start in range(0, count, self.block_size):
+                other = encodings[other_start:other_start + self.block_size]
+                squared = block @ other.T
+                squared *= -2
+                squared += norms[start:start + len(block), None]
+                squared += norms[None, other_start:other_start + len(other)]
+                if other_start == start:
+                    np.fill_diagonal(squared, np.inf)  # A face is not its own neighbour
+
+                # Keep the block's k closest per row, then merge them with the closest found so far
+                columns = np.broadcast_to(np.arange(len(other), dtype=np.int32), squared.shape)
+                if len(other) > k:
+                    columns = np.argpartition(squared, k - 1, axis=1)[:, :k].astype(np.int32)
+                    squared = np.take_along_axis(squared, columns, axis=1)
+                candidate_indices = np.hstack([best_indices, columns + np.int32(other_start)])
+                candidate_distances = np.hstack([best_distances, squared])
+                if candidate_distances.shape[1] > k:
+                    keep = np.argpartition(candidate_distances, k - 1, axis=1)[:, :k]
+                    candidate_indices = np.take_along_axis(candidate_indices, keep, axis=1)
+                    candidate_distances = np.take_along_axis(candidate_distances, keep, axis=1)
+                best_indices, best_distances = candidate_indices, candidate_distances
+
+            indices[start:start + len(block)] = best_indices
+            distances[start:start + len(block)] = best_distances
+        return indices, distances
+
+    def graph(self, encodings):
+        """
+        Builds the sparse neighbour graph.
+
+        Parameters:
+        - encodings: (N, 128) array.
+
+        Returns:
+        - (indptr, indices, weights) in CSR form: the neighbours of face i
+          are indices[indptr[i]:indptr[i + 1]] (int32), with their weights.
+          Closer faces get larger weights.
+        """
+        count = len(encodings)
+        if count < 2:
+            return np.zeros(count + 1, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+        indices, squared = self.nearest(encodings)
+        linked = squared <= self.tolerance ** 2
+        indptr = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(linked.sum(axis=1), out=indptr[1:])
+        weights = 1.0 - np.sqrt(np.maximum(squared[linked], 0)) / (self.tolerance * 2)
+        return indptr, indices[linked], weights.astype(np.float32)
+
+    def cluster(self, encodings):
+        """
+        Returns one integer label per encoding. Labels are numbered from 0 by
+        decreasing cluster size (ties by first member), so the same input
+        always gives the same numbering.
+        """
+        count = len(encodings)
+        if count == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        indptr, indices, weights = self.graph(encodings)
+        labels = np.arange(count, dtype=np.int32)
+        if len(indices) == 0:
+            return self.canonical_labels(labels)
+
+        # Every node has at most `neighbors` edges, so they fit one padded row per node
+        degree = np.diff(indptr)
+        width = int(degree.max())
+        slots = np.arange(width)
+        present = slots[None, :] < degree[:, None]
+        neighbors = np.zeros((count, width), dtype=np.int32)
+        neighbors[present] = indices
+        neighbor_weights = np.zeros((count, width), dtype=np.float32)
+        neighbor_weights[present] = weights
+        has_neighbors = degree > 0
+        rng = np.random.default_rng(self.seed)
+
+        for _ in range(self.iterations):
+            # Weight of each neighbour's label summed over the node's neighbours with the same label
+            neighbor_labels = labels[neighbors]
+            same = neighbor_labels[:, :, None] == neighbor_labels[:, None, :]
+            totals = np.einsum("nij,nj->ni", same, neighbor_weights, dtype=np.float32)
+            totals[~present] = -1
+            # Heaviest label per node, ties go to the smallest label
+            heaviest = totals >= totals.max(axis=1, keepdims=True)
+            candidates = np.where(heaviest, neighbor_labels, np.iinfo(np.int32).max)
+            proposed = np.where(has_neighbors, candidates.min(axis=1), labels).astype(np.int32)
+
+            # Only a random half moves per round, which keeps neighbours from swapping labels forever
+            update = rng.random(count) < 0.5
+            new_labels = np.where(update, proposed, labels)
+            if np.array_equal(new_labels, labels) and np.array_equal(proposed, labels):
+                break
+            labels = new_labels
+
+        return self.canonical_labels(labels)
+
+    @staticmethod
+    def canonical_labels(labels):
+        unique, first_index, inverse, sizes = np.unique(labels, return_index=True, return_inverse=True,
+                                                        return_counts=True)
+        order = np.lexsort((first_index, -sizes))
+        rank = np.empty(len(unique), dtype=np.int64)
+        rank[order] = np.arange(len(unique))
+        return rank[inverse.ravel()]
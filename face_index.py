@@ -0,0 +1,130 @@
+import numpy as np
+
+
+class FaceIndex:
+    """
+    Every face found in a library, with the image it came from.
+
+    Encodings are kept in one growing float32 array, so a nearest-neighbour
+    lookup is a blocked NumPy distance computation over all faces at once.
+    An image can hold several faces and so belong to several people.
+    """
+
+    def __init__(self, block_size=65536):
+        self.block_size = block_size
+        self.encodings = np.zeros((0, 128), dtype=np.float32)
+        self.norms = np.zeros(0, dtype=np.float32)
+        self.count = 0
+        self.paths = []
+        self.locations = []
+        self.labels = np.zeros(0, dtype=np.int64)  # Person label per face, -1 until clustered
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.__init__(self.block_size)
+
+    def add(self, image_path, face_locations, face_encodings):
+        """Adds every face of one image. Returns the indices the faces were given."""
+        face_encodings = np.asarray(face_encodings, dtype=np.float32).reshape(-1, 128)
+        added = len(face_encodings)
+        if self.count + added > len(self.encodings):
+            # Grow by doubling so adding faces one image at a time stays linear overall
+            capacity = max(self.count + added, len(self.encodings) * 2, 1024)
+            self.encodings = np.resize(self.encodings, (capacity, 128))
+            self.norms = np.resize(self.norms, capacity)
+            self.labels = np.resize(self.labels, capacity)
+
+        indices = np.arange(self.count, self.count + added)
+        self.encodings[indices] = face_encodings
+        self.norms[indices] = np.einsum("ij,ij->i", face_encodings, face_encodings)
+        self.labels[indices] = -1
+        self.paths += [image_path] * added
+        self.locations += [tuple(location) for location in face_locations]
+        self.count += added
+        return indices
+
+    def get_encodings(self):
+        return self.encodings[:self.count]
+
+    def sort_by_path(self):
+        """Orders faces by image path (faces within an image keep their order), so results don't depend on arrival order."""
+        order = np.argsort(np.array(self.paths, dtype=object), kind="stable")
+        self.encodings[:self.count] = self.encodings[order]
+        self.norms[:self.count] = self.norms[order]
+        self.labels[:self.count] = self.labels[order]
+        self.paths = [self.paths[i] for i in order]
+        self.locations = [self.locations[i] for i in order]
+
+    def remove_paths(self, image_paths):
+        """Drops every face found in the given images."""
+        image_paths = set(image_paths)
+        keep = np.array([path not in image_paths for path in self.paths], dtype=bool)
+        if keep.all():
+            return
+        kept = np.flatnonzero(keep)
+        self.encodings[:len(kept)] = self.encodings[kept]
+        self.norms[:len(kept)] = self.norms[kept]
+        self.labels[:len(kept)] = self.labels[kept]
+        self.paths = [self.paths[i] for i in kept]
+        self.locations = [self.locations[i] for i in kept]
+        self.count = len(kept)
+
+    def locations_of(self, image_path):
+        """Face locations found in one image, as (top, right, bottom, left) tuples."""
+        return [location for path, location in zip(self.paths, self.locations) if path == image_path]
+
+    def set_labels(self, labels):
+        self.labels[:self.count] = labels
+
+    def query(self, encoding, tolerance=0.6):
+        """
+        Finds every face within tolerance of an encoding.
+
+        Parameters:
+        - encoding: A 128-d face encoding.
+        - tolerance: Largest Euclidean distance counted as a match.
+
+        Returns:
+        - (indices, distances) of the matching faces, closest first.
+        """
+        encoding = np.asarray(encoding, dtype=np.float32).reshape(128)
+        limit = tolerance ** 2
+        indices, squared = [], []
+        for start in range(0, self.count, self.block_size):
+            stop = min(start + self.block_size, self.count)
+            block = self.norms[start:stop] - 2 * (self.encodings[start:stop] @ encoding) + encoding @ encoding
+            matches = np.flatnonzero(block <= limit)
+            indices.append(matches + start)
+            squared.append(block[matches])
+
+        if not indices:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        indices, squared = np.concatenate(indices), np.concatenate(squared)
+        order = np.argsort(squared, kind="stable")
+        return indices[order], np.sqrt(np.maximum(squared[order], 0))
+
+    def images_matching(self, encoding, tolerance=0.6):
+        """Paths of all images with at least one face within tolerance, closest first."""
+        indices, _ = self.query(encoding, tolerance)
+        return list(dict.fromkeys(self.paths[i] for i in indices))
+
+    def nearest_person(self, encoding, tolerance=0.6):
+        """Label of the closest already labelled face within tolerance, or -1."""
+        indices, _ = self.query(encoding, tolerance)
+        labels = self.labels[indices]
+        labelled = labels[labels >= 0]
+        return int(labelled[0]) if len(labelled) else -1
+
+    def person_center(self, label):
+        """Mean encoding of the faces labelled as one person, or None."""
+        members = np.flatnonzero(self.labels[:self.count] == label)
+        if not len(members):
+            return None
+        return self.encodings[members].mean(axis=0)
+
+    def images_of(self, label):
+        """Paths of the images with a face labelled as a person, in index order."""
+        members = np.flatnonzero(self.labels[:self.count] == label)
+        return list(dict.fromkeys(self.paths[i] for i in members))
@@ -0,0 +1,109 @@
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import numpy as np
+from PIL import Image, ImageOps
+from face_cache import DEFAULT_CACHE_PATH, FaceEncodingCache
+
+
+def encode_image(image_path):
+    """
+    Runs in a worker process: decodes one image and encodes every face in it.
+
+    Returns:
+    - (image_path, face_locations, face_encodings) with the encodings as a
+      (faces, 128) float array.
+    """
+    import face_recognition
+
+    # Rotated by EXIF orientation like cv2.imread does, so the locations match the editor's pixels
+    with Image.open(image_path) as source:
+        image = np.array(ImageOps.exif_transpose(source).convert("RGB"))
+    face_locations = face_recognition.face_locations(image)
+    face_encodings = face_recognition.face_encodings(image, face_locations)
+    return image_path, face_locations, np.array(face_encodings, dtype=np.float64).reshape(-1, 128)
+
+
+class FaceEncodingPipeline:
+    """
+    Encodes faces for a list of images on a process pool, off the Tk thread.
+
+    A feeder thread keeps a bounded number of images in flight across all
+    cores and puts messages on `results` as each one finishes:
+    ("result", path, locations, encodings), ("error", path, message) and a
+    final ("done", cancelled). The UI drains the queue with root.after.
+
+    Images found unchanged in the encoding cache are reported straight away
+    and never reach the pool; new results are written back to the cache.
+    """
+
+    def __init__(self, image_paths, workers=None, max_pending=None, cache_path=DEFAULT_CACHE_PATH):
+        self.image_paths = list(image_paths)
+        self.cache_path = cache_path
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 4
+        self.results = queue.Queue()
+        self.cancelled = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self):
+        # The cache is opened here, SQLite connections can't move between threads
+        cache = FaceEncodingCache(self.cache_path) if self.cache_path else None
+        misses = self.image_paths
+        if cache is not None:
+            hits = cache.get_many(self.image_paths)
+            for image_path in self.image_paths:
+                if image_path in hits:
+                    self.results.put(("result", image_path) + hits[image_path])
+            misses = [image_path for image_path in self.image_paths if image_path not in hits]
+
+        if misses and not self.cancelled.is_set():
+            self.encode(misses, cache)
+        if cache is not None:
+            cache.close()
+        self.results.put(("done", self.cancelled.is_set()))
+
+    def encode(self, image_paths, cache):
+        # Spawned, not forked: forking a process that has Tk open is not safe
+        context = multiprocessing.get_context("spawn")
+        paths = iter(image_paths)
+        pending = {}
+        encoded = []
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as pool:
+            while not self.cancelled.is_set():
+                for image_path in paths:
+                    pending[pool.submit(encode_image, image_path)] = image_path
+                    if len(pending) >= self.max_pending:
+                        break
+                if not pending:
+                    break
+
+                done, _ = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in done:
+                    image_path = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as error:
+                        self.results.put(("error", image_path, str(error)))
+                        continue
+                    self.results.put(("result",) + result)
+                    encoded.append(result)
+
+                if cache is not None and len(encoded) >= 100:
+                    cache.put_many(encoded)
+                    encoded.clear()
+
+            for future in pending:
+                future.cancel()
+        if cache is not None and encoded:
+            cache.put_many(encoded)
@@ -1,54 +1,155 @@
-import cv2
+import threading
+from collections import OrderedDict
 import numpy as np
-import dlib
 from PIL import Image
+from face_analysis import FaceAnalysisService, default_service
+from lazy_import import lazy_module
 
-class SunglassesFilter:
-    def __init__(self, predictor_path="shape_predictor_68_face_landmarks.dat", filter_image_path="sunglasses.png"):
-        self.face_detector = dlib.get_frontal_face_detector()
-        self.landmark_predictor = dlib.shape_predictor(predictor_path)
-        self.sunglasses_image = cv2.imread(filter_image_path, cv2.IMREAD_UNCHANGED)
+cv2 = lazy_module("cv2")
 
-    def apply_filter(self, image):
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        faces = self.face_detector(gray)
 
-        # Create an empty transparent layer for sunglass
-        sunglasses_layer = np.zeros((image.shape[0], image.shape[1], 4), dtype=np.uint8)
-
-        for face in faces:
-            # fetch face landmarks
-            landmarks = self.landmark_predictor(gray, face)
-
-            # Extract coordinates for temples
-            left_temple_x = landmarks.part(0).x
-            right_temple_x = landmarks.part(16).x
-
-            # Find width of the sunglasses based on temple distance
-            sunglasses_width = int(right_temple_x - left_temple_x)
-            sunglasses_height = int(sunglasses_width * self.sunglasses_image.shape[0] / self.sunglasses_image.shape[1])
-            sunglasses_resized = cv2.resize(self.sunglasses_image, (sunglasses_width, sunglasses_height))
-
-            eye_mid_y = int((landmarks.part(36).y + landmarks.part(45).y) / 2)  # Midpoint between eyes
-            x_offset = left_temple_x
-            y_offset = eye_mid_y - int(sunglasses_height / 2)
-
-            # Extract the alpha channel from the sunglasses image for transparency
-            if sunglasses_resized.shape[2] == 4:
-                b, g, r, a = cv2.split(sunglasses_resized)
-                overlay_color = cv2.merge((b, g, r, a))
-            else:
-                print("Error: The sunglasses image does not have an alpha channel.")
+class SunglassesFilter:
+    """
+    Draws sunglasses over every face, scaled to the temples and tilted with the eyes.
+
+    The sunglasses image is premultiplied by its alpha once when it is
+    loaded. Resized and rotated copies are cached by width and angle,
+    rounded to `size_step` pixels and `angle_step` degrees, so a video or a
+    repeated apply reuses them. Faces partly outside the image are clipped
+    rather than skipped.
+    """
+
+    def __init__(self, predictor_path=None, filter_image_path="sunglasses.png", face_analysis=None,
+                 size_step=2, angle_step=2.0, max_sprites=64):
+        # Detection and landmarks come from the shared service, which caches them per image
+        if face_analysis is None:
+            face_analysis = FaceAnalysisService(predictor_path) if predictor_path else default_service()
+        self.face_analysis = face_analysis
+        self.filter_image_path = filter_image_path
+        self.size_step = size_step
+        self.angle_step = angle_step
+        self.max_sprites = max_sprites
+        self.premultiplied = None  # float32 BGRA sunglasses, color multiplied by alpha
+        self.sprites = OrderedDict()  # (width, angle) -> (premultiplied BGR, alpha 0..1)
+        self.sprite_lock = threading.Lock()
+
+    def load_models(self):
+        """Loads the face models and the sunglasses image. Safe to call from a background thread."""
+        self.face_analysis.load_models()
+        if self.premultiplied is None:
+            image = cv2.imread(self.filter_image_path, cv2.IMREAD_UNCHANGED)
+            if image is None:
+                raise OSError(f"Could not read {self.filter_image_path}")
+            if image.ndim != 3 or image.shape[2] != 4:
+                raise ValueError("The sunglasses image does not have an alpha channel.")
+            image = image.astype(np.float32)
+            image[:, :, :3] *= image[:, :, 3:] / 255
+            self.premultiplied = image
+
+    def placement(self, landmarks):
+        """Returns (center_x, center_y, width, angle in degrees) of the sunglasses for one face's 68 landmarks."""
+        landmarks = landmarks.astype(np.float64)
+        left_temple, right_temple = landmarks[0], landmarks[16]
+        width = float(np.hypot(*(right_temple - left_temple)))
+
+        # Tilt follows the line through the eye centers
+        dx, dy = landmarks[42:48].mean(axis=0) - landmarks[36:42].mean(axis=0)
+        angle = float(np.degrees(np.arctan2(dy, dx)))
+
+        # Centered between the temples along the eye line, on the outer eye corners across it
+        eye_mid = (landmarks[36] + landmarks[45]) / 2
+        direction = np.array([np.cos(np.radians(angle)), np.sin(np.radians(angle))])
+        center = eye_mid + direction * np.dot((left_temple + right_temple) / 2 - eye_mid, direction)
+        return float(center[0]), float(center[1]), width, angle
+
+    def sprite(self, width, angle):
+        """
+        The sunglasses at one width and tilt, from the cache when a close enough copy exists.
+
+        Returns:
+        - (color, alpha): premultiplied BGR float32 array and a matching
+          (h, w, 1) alpha array in 0..1, rotated within an enlarged box.
+        """
+        width = max(self.size_step, int(round(width / self.size_step)) * self.size_step)
+        angle = round(angle / self.angle_step) * self.angle_step
+        key = (width, angle)
+        with self.sprite_lock:
+            sprite = self.sprites.get(key)
+            if sprite is not None:
+                self.sprites.move_to_end(key)
+                return sprite
+
+        source = self.premultiplied
+        height = max(1, round(width * source.shape[0] / source.shape[1]))
+        interpolation = cv2.INTER_AREA if width < source.shape[1] else cv2.INTER_LINEAR
+        image = cv2.resize(source, (width, height), interpolation=interpolation)
+        if angle:
+            cos, sin = abs(np.cos(np.radians(angle))), abs(np.sin(np.radians(angle)))
+            out_width = int(np.ceil(width * cos + height * sin))
+            out_height = int(np.ceil(width * sin + height * cos))
+            # OpenCV angles turn counter-clockwise on screen, image y points down
+            matrix = cv2.getRotationMatrix2D(((width - 1) / 2, (height - 1) / 2), -angle, 1.0)
+            matrix[0, 2] += (out_width - width) / 2
+            matrix[1, 2] += (out_height - height) / 2
+            image = cv2.warpAffine(image, matrix, (out_width, out_height), flags=cv2.INTER_LINEAR,
+                                   borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        sprite = (np.ascontiguousarray(image[:, :, :3]), image[:, :, 3:] / 255)
+
+        with self.sprite_lock:
+            self.sprites[key] = sprite
+            while len(self.sprites) > self.max_sprites:
+                self.sprites.popitem(last=False)
+        return sprite
+
+    def sprite_regions(self, shape, landmarks_list):
+        """Yields (x, y, color, alpha) per face: its sprite cropped to an image of the given shape, placed at (x, y)."""
+        for landmarks in landmarks_list:
+            if landmarks is None:
                 continue
-
-            y1, y2 = y_offset, y_offset + sunglasses_height
-            x1, x2 = x_offset, x_offset + sunglasses_width
-            if y1 < 0 or y2 > image.shape[0] or x1 < 0 or x2 > image.shape[1]:
+            center_x, center_y, width, angle = self.placement(landmarks)
+            if width < 1:
                 continue
+            color, alpha = self.sprite(width, angle)
+            x = int(round(center_x - color.shape[1] / 2))
+            y = int(round(center_y - color.shape[0] / 2))
+            x1, y1 = max(x, 0), max(y, 0)
+            x2, y2 = min(x + color.shape[1], shape[1]), min(y + color.shape[0], shape[0])
+            if x1 >= x2 or y1 >= y2:
+                continue
+            yield x1, y1, color[y1 - y:y2 - y, x1 - x:x2 - x], alpha[y1 - y:y2 - y, x1 - x:x2 - x]
+
+    def blend(self, image, landmarks_list):
+        """Draws the sunglasses into a BGR uint8 image in place, touching only the pixels they cover."""
+        for x, y, color, alpha in self.sprite_regions(image.shape, landmarks_list):
+            region = image[y:y + color.shape[0], x:x + color.shape[1]]
+            region[:] = np.clip(region * (1 - alpha) + color + 0.5, 0, 255).astype(np.uint8)
+
+    def render_patches(self, image):
+        """
+        Renders the sunglasses for every face in a BGR image as a sparse layer.
+
+        Parameters:
+        - image: A 3-channel BGR array.
+
+        Returns:
+        - A list of (x, y, patch) tuples, where patch is a PIL RGBA image
+          (straight alpha) to be placed at (x, y). Patches are clipped to the
+          image.
+        """
+        self.load_models()
+        analysis = self.face_analysis.analyze(image)
+        patches = []
+        for x, y, color, alpha in self.sprite_regions(image.shape, analysis["landmarks"]):
+            straight = color[:, :, ::-1] / np.maximum(alpha, 1 / 255)
+            rgba = np.clip(np.dstack([straight, alpha * 255]) + 0.5, 0, 255).astype(np.uint8)
+            patches.append((x, y, Image.fromarray(rgba, "RGBA")))
+        return patches
 
-            # Extract the region of interest from the sunglasses layer
-            sunglasses_layer[y1:y2, x1:x2] = overlay_color
-
+    def apply_filter(self, image):
+        """Returns a full-size BGRA layer holding the sunglasses. render_patches avoids the full-size array."""
+        sunglasses_layer = np.zeros((image.shape[0], image.shape[1], 4), dtype=np.uint8)
+        for x, y, patch in self.render_patches(image):
+            sunglasses_layer[y:y + patch.height, x:x + patch.width] = np.asarray(patch)[:, :, [2, 1, 0, 3]]
         return sunglasses_layer
 
 
@@ -1,64 +1,313 @@
-import cv2
+import math
+import os
 import numpy as np
 from PIL import Image
+from lazy_import import lazy_module
+
+cv2 = lazy_module("cv2")
+
+
+# Sharpening kernel used by apply_sharpen and the "sharpen" operation
+SHARPEN_KERNEL = np.array([[0, -1, 0],
+                           [-1, 5, -1],
+                           [0, -1, 0]], dtype=np.float32)
+
+
+def odd_kernel_size(kernel_size):
+    """Rounds each side of a kernel size up to the next odd number, as GaussianBlur requires. 0 stays 0."""
+    if isinstance(kernel_size, (int, float)):
+        kernel_size = (kernel_size, kernel_size)
+    return tuple(int(side) if int(side) % 2 == 1 or int(side) == 0 else int(side) + 1 for side in kernel_size)
+
+
+def gaussian_sigma(kernel_size):
+    """The sigma OpenCV's GaussianBlur picks for an odd kernel size when given sigma 0."""
+    return 0.3 * ((kernel_size - 1) * 0.5 - 1) + 0.8
+
+
+# Gaussian blurs from this sigma up use box filters, from the next one up a shrunk copy
+BOX_BLUR_MIN_SIGMA = 3.0
+PYRAMID_BLUR_MIN_SIGMA = 6.0
+
+
+def box_sizes(sigma, passes=3):
+    """Widths of `passes` odd box filters that together approximate a Gaussian of sigma (Kovesi's method)."""
+    ideal = math.sqrt(12 * sigma * sigma / passes + 1)
+    lower = int(math.floor(ideal))
+    if lower % 2 == 0:
+        lower -= 1
+    upper = lower + 2
+    # How many passes use the smaller width so the variances add up to sigma squared
+    smaller = round((12 * sigma * sigma - passes * lower * lower - 4 * passes * lower - 3 * passes)
+                    / (-4 * lower - 4))
+    return [lower if i < smaller else upper for i in range(passes)]
+
+
+def pyramid_factor(sigma):
+    """How much pyramid_blur shrinks the image for a given sigma, a power of two."""
+    return 2 ** max(0, int(math.floor(math.log2(max(sigma, 1.0) / 3))))
+
+
+def direct_blur(source, target, sigma):
+    cv2.GaussianBlur(source, (0, 0), sigma, dst=target)
+
+
+def box_blur(source, target, sigma):
+    """Approximates a Gaussian with three box filters, each a running sum whose cost doesn't grow with width."""
+    for index, width in enumerate(box_sizes(sigma)):
+        cv2.blur(source if index == 0 else target, (width, width), dst=target)
+
+
+def pyramid_blur(source, target, sigma):
+    """Shrinks the image, blurs it with a smaller sigma and scales the result back up."""
+    factor = pyramid_factor(sigma)
+    height, width = source.shape[:2]
+    small = cv2.resize(source, (-(-width // factor), -(-height // factor)), interpolation=cv2.INTER_AREA)
+    # Shrinking and enlarging each blur by about factor**2 / 12, so the blur in between does the rest
+    remaining = sigma * sigma - (factor * factor - 1) / 12 - factor * factor / 12
+    cv2.GaussianBlur(small, (0, 0), math.sqrt(max(remaining, 0.25)) / factor, dst=small)
+    cv2.resize(small, (width, height), dst=target, interpolation=cv2.INTER_LINEAR)
+
+
+BLUR_METHODS = {
+    "direct": direct_blur,
+    "box": box_blur,
+    "pyramid": pyramid_blur,
+}
+
+
+def blur_method(sigma):
+    """The method "auto" picks: exact for small blurs, approximations whose cost stays flat for large ones."""
+    if sigma >= PYRAMID_BLUR_MIN_SIGMA:
+        return "pyramid"
+    if sigma >= BOX_BLUR_MIN_SIGMA:
+        return "box"
+    return "direct"
+
+
+def blur_radius(kernel_size=(5, 5), sigma=0):
+    """How far blur_operation reads around each pixel, for filtering tile by tile."""
+    kernel_size = odd_kernel_size(kernel_size)
+    sigma = sigma or gaussian_sigma(kernel_size[0])
+    factor = pyramid_factor(sigma)
+    return max(max(kernel_size) // 2, int(math.ceil(3 * sigma)) + (2 * factor if factor > 1 else 0))
+
+
+def blur_operation(source, target, kernel_size=(5, 5), sigma=0, method="auto"):
+    # With kernel_size (0, 0) the kernel is sized from sigma
+    kernel_size = odd_kernel_size(kernel_size)
+    if method == "auto":
+        # Rectangular kernels only run directly
+        square = kernel_size[0] == kernel_size[1]
+        method = blur_method(sigma or gaussian_sigma(kernel_size[0])) if square else "direct"
+    if method == "direct" and kernel_size != (0, 0):
+        cv2.GaussianBlur(source, kernel_size, sigma, dst=target)
+        return
+    BLUR_METHODS[method](source, target, sigma or gaussian_sigma(kernel_size[0]))
+
+
+def sharpen_operation(source, target):
+    cv2.filter2D(source, -1, SHARPEN_KERNEL, dst=target)
+
+
+def unsharp_operation(source, target, sigma=2.0, amount=1.0):
+    """Adds `amount` times the difference between the image and its blur."""
+    blur_operation(source, target, (0, 0), sigma)
+    cv2.addWeighted(source, 1 + amount, target, -amount, 0, dst=target)
+
+
+def median_operation(source, target, size=5):
+    size = odd_kernel_size(size)[0]
+    if source.dtype == np.uint8 or size <= 5:
+        cv2.medianBlur(source, size, dst=target)
+        return
+    # OpenCV only takes float32 up to size 5; premultiplied values are 0..255, so uint8 loses little
+    target[:] = cv2.medianBlur(np.clip(source + 0.5, 0, 255).astype(np.uint8), size)
+
+
+def bilateral_operation(source, target, diameter=9, sigma_color=50.0, sigma_space=9.0):
+    # OpenCV's bilateral filter takes three channels at most, alpha is passed through
+    target[:, :, :3] = cv2.bilateralFilter(np.ascontiguousarray(source[:, :, :3]), diameter, sigma_color, sigma_space)
+    target[:, :, 3] = source[:, :, 3]
+
+
+def curves_operation(source, target, shadows=64, midtones=128, highlights=192):
+    """Tone curve through (0, 0), (64, shadows), (128, midtones), (192, highlights) and (255, 255)."""
+    points = ([0, 64, 128, 192, 255], [0, shadows, midtones, highlights, 255])
+    if source.dtype == np.uint8:
+        lut = np.clip(np.interp(np.arange(256), *points) + 0.5, 0, 255).astype(np.uint8)
+        target[:, :, :3] = lut[source[:, :, :3]]
+        target[:, :, 3] = source[:, :, 3]
+        return
+    # The curve applies to straight color, so premultiplied pixels are divided by alpha first
+    alpha = source[:, :, 3:]
+    straight = source[:, :, :3] * 255 / np.maximum(alpha, 1e-3)
+    target[:, :, :3] = np.interp(straight, *points) * alpha / 255
+    target[:, :, 3:] = alpha
+
+
+class FilterKernel:
+    """
+    One entry of the filter registry.
+
+    Parameters:
+    - name: Name used in pipelines, the batch CLI and history.
+    - function: function(source, target, **parameters) that writes source
+      filtered into target. Both are (h, w, 4) arrays of the same type,
+      uint8 or premultiplied float32.
+    - parameters: (name, default, minimum, maximum) for every parameter the
+      editor and the batch CLI expose. The default's type is the parameter's type.
+    - halo: How far the filter reads around each pixel, as an int or a
+      function of the parameters. Tiles are filtered with this much context.
+    - label: Name shown in the editor.
+    """
+
+    def __init__(self, name, function, parameters=(), halo=0, label=None):
+        self.name = name
+        self.function = function
+        self.parameters = list(parameters)
+        self.halo = halo
+        self.label = label or name.capitalize()
+
+    def __call__(self, source, target, **parameters):
+        self.function(source, target, **parameters)
+
+    def defaults(self):
+        return {name: default for name, default, _, _ in self.parameters}
+
+    def convert(self, values):
+        """Casts parameter values (such as strings from the command line) to the parameters' types."""
+        types = {name: type(default) for name, default, _, _ in self.parameters}
+        return {name: types[name](float(value)) if name in types else value for name, value in values.items()}
+
+    def footprint(self, **parameters):
+        if callable(self.halo):
+            return self.halo(**dict(self.defaults(), **parameters))
+        return self.halo
+
+
+# Filter name -> FilterKernel, in the order they appear in the editor
+FILTERS = {}
+
+
+def register_filter(name, function, parameters=(), halo=0, label=None):
+    """Adds a filter to the registry, which makes it available to Filter, the editor and the batch CLI."""
+    FILTERS[name] = FilterKernel(name, function, parameters, halo, label)
+    return FILTERS[name]
+
+
+register_filter("blur", blur_operation, [("kernel_size", 5, 1, 101)],
+                halo=lambda kernel_size, sigma=0, method="auto": blur_radius(kernel_size, sigma))
+register_filter("sharpen", sharpen_operation, halo=1)
+register_filter("unsharp", unsharp_operation, [("sigma", 2.0, 0.5, 20.0), ("amount", 1.0, 0.1, 3.0)],
+                halo=lambda sigma, amount: blur_radius((0, 0), sigma), label="Unsharp Mask")
+register_filter("median", median_operation, [("size", 5, 3, 21)], halo=lambda size: size // 2)
+register_filter("bilateral", bilateral_operation,
+                [("diameter", 9, 3, 25), ("sigma_color", 50.0, 5.0, 150.0), ("sigma_space", 9.0, 1.0, 25.0)],
+                halo=lambda diameter, sigma_color, sigma_space: diameter // 2)
+register_filter("curves", curves_operation,
+                [("shadows", 64, 0, 255), ("midtones", 128, 0, 255), ("highlights", 192, 0, 255)],
+                label="Color Curves")
 
 
 class Filter:
+    # Operation name -> FilterKernel, see register_filter
+    OPERATIONS = FILTERS
+
     def __init__(self):
         pass
 
-    def apply_blur(self, image, kernel_size=(5, 5)):
+    def resolve(self, operations):
+        """Turns operation names or (name, parameters) pairs into (FilterKernel, parameters) pairs."""
+        steps = []
+        for operation in operations:
+            name, parameters = (operation, {}) if isinstance(operation, str) else operation
+            if name not in self.OPERATIONS:
+                raise ValueError(f"Unknown filter operation {name!r}")
+            steps.append((self.OPERATIONS[name], parameters))
+        return steps
+
+    def apply_pipeline(self, image, operations):
         """
-        Applies a Gaussian blur filter to the given image.
+        Runs several operations on an image with a single conversion in each direction.
+
+        The pixels stay in one contiguous RGBA array, and every operation
+        writes into the other of two reused buffers. Opaque images are
+        filtered as uint8. Images with transparency are filtered as
+        premultiplied float32, so transparent pixels don't bleed their color
+        into visible ones, and the alpha channel is filtered along with the
+        color.
 
         Parameters:
         - image: PIL.Image object representing the input image.
-        - kernel_size: Tuple representing the size of the Gaussian kernel.
+        - operations: List of operation names or (name, parameters dict) pairs,
+          such as ["sharpen", ("blur", {"kernel_size": (7, 7)})].
 
         Returns:
-        - A PIL.Image object representing the blurred image.
+        - A PIL.Image RGBA object with every operation applied in order.
         """
-        # Ensure kernel size is odd and greater than 0
-        kernel_size = (kernel_size[0] if kernel_size[0] % 2 == 1 else kernel_size[0] + 1,
-                       kernel_size[1] if kernel_size[1] % 2 == 1 else kernel_size[1] + 1)
+        steps = self.resolve(operations)
 
-        # Convert the PIL image to an OpenCV format (numpy array)
-        image_np = np.array(image)
-        image_cv = cv2.cvtColor(image_np, cv2.COLOR_RGBA2BGR)
+        pixels = np.array(image.convert("RGBA"))
+        opaque = pixels[:, :, 3].min() == 255
+        if not opaque:
+            pixels = pixels.astype(np.float32)
+            pixels[:, :, :3] *= pixels[:, :, 3:] / 255
 
-        # Apply the Gaussian blur filter using OpenCV
-        blurred_image_cv = cv2.GaussianBlur(image_cv, kernel_size, 0)
+        spare = np.empty_like(pixels)
+        for function, parameters in steps:
+            function(pixels, spare, **parameters)
+            pixels, spare = spare, pixels
 
-        # Convert the OpenCV image back to PIL format
-        blurred_image_np = cv2.cvtColor(blurred_image_cv, cv2.COLOR_BGR2RGBA)
-        blurred_image_pil = Image.fromarray(blurred_image_np)
+        if not opaque:
+            alpha = np.clip(pixels[:, :, 3:], 0, 255)
+            color = pixels[:, :, :3] * 255 / np.maximum(alpha, 1e-3)
+            pixels = np.clip(np.dstack([color, alpha]) + 0.5, 0, 255).astype(np.uint8)
+        return Image.fromarray(pixels, "RGBA")
 
-        return blurred_image_pil
+    def apply_tiled(self, tiles, operations, workers=None):
+        """
+        Runs operations over a TiledImage tile by tile on a thread pool.
 
-    def apply_sharpen(self, image):
+        Each tile is filtered with enough surrounding pixels for every
+        operation in the chain (the sum of their halos), so the result
+        matches filtering the whole image while only a few tiles per worker
+        are in memory at once. OpenCV releases the GIL, so the tiles run in
+        parallel.
+
+        Parameters:
+        - tiles: TiledImage to filter.
+        - operations: Same as for apply_pipeline.
+        - workers: Number of threads, the number of CPUs by default.
+
+        Returns:
+        - A new TiledImage.
         """
-        Applies a sharpening filter to the given image.
+        halo = sum(kernel.footprint(**parameters) for kernel, parameters in self.resolve(operations))
+        return tiles.map_tiles(lambda tile: self.apply_pipeline(tile, operations), halo=halo,
+                               workers=workers or os.cpu_count() or 1)
+
+    def apply_blur(self, image, kernel_size=(5, 5)):
+        """
+        Applies a Gaussian blur filter to the given image.
 
         Parameters:
         - image: PIL.Image object representing the input image.
+        - kernel_size: Tuple representing the size of the Gaussian kernel.
 
         Returns:
-        - A PIL.Image object representing the sharpened image.
+        - A PIL.Image object representing the blurred image, alpha included.
         """
-        # Convert the PIL image to an OpenCV format (numpy array)
-        image_np = np.array(image)
-        image_cv = cv2.cvtColor(image_np, cv2.COLOR_RGBA2BGR)
+        return self.apply_pipeline(image, [("blur", {"kernel_size": kernel_size})])
 
-        # Define the sharpening kernel
-        kernel = np.array([[0, -1, 0],
-                           [-1, 5, -1],
-                           [0, -1, 0]])
-
-        # Apply the sharpening filter using OpenCV
-        sharpened_image_cv = cv2.filter2D(src=image_cv, ddepth=-1, kernel=kernel)
+    def apply_sharpen(self, image):
+        """
+        Applies a sharpening filter to the given image.
 
-        # Convert the OpenCV image back to PIL format
-        sharpened_image_np = cv2.cvtColor(sharpened_image_cv, cv2.COLOR_BGR2RGBA)
-        sharpened_image_pil = Image.fromarray(sharpened_image_np)
+        Parameters:
+        - image: PIL.Image object representing the input image.
 
-        return sharpened_image_pil
+        Returns:
+        - A PIL.Image object representing the sharpened image, alpha included.
+        """
+        return self.apply_pipeline(image, ["sharpen"])
@@ -0,0 +1,40 @@
+import queue
+import threading
+from filter import Filter
+
+
+class FilterJob:
+    """
+    Runs registered filters over a TiledImage in the background.
+
+    The tiles themselves are filtered on Filter.apply_tiled's thread pool;
+    this thread only keeps the UI free while they run. The result is put on
+    `results` as ("done", TiledImage) or ("error", message). Nothing is put
+    once the job is cancelled.
+    """
+
+    def __init__(self, tiles, operations, workers=None):
+        self.tiles = tiles
+        self.operations = operations
+        self.workers = workers
+        self.results = queue.Queue()
+        self.cancelled = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self):
+        try:
+            filtered = Filter().apply_tiled(self.tiles, self.operations, self.workers)
+        except Exception as error:
+            if not self.cancelled.is_set():
+                self.results.put(("error", str(error)))
+            return
+        if not self.cancelled.is_set():
+            self.results.put(("done", filtered))
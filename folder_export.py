@@ -0,0 +1,188 @@
+import os
+import queue
+import shutil
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+try:
+    import fcntl
+except ImportError:  # Windows, where reflink mode falls back to copying
+    fcntl = None
+
+EXPORT_MODES = ("copy", "hardlink", "reflink", "symlink")
+
+# ioctl from <linux/fs.h> that shares a file's extents on copy-on-write filesystems (Btrfs, XFS)
+FICLONE = 0x40049409
+
+CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def copy_file(source, destination, chunk_size=CHUNK_SIZE):
+    """
+    Copies file contents and modification time.
+
+    The data is moved with os.copy_file_range in large chunks where the
+    kernel supports it, so it never passes through Python; otherwise it
+    falls back to shutil.copyfileobj with the same buffer size.
+    """
+    with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+        remaining = os.fstat(source_file.fileno()).st_size
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(source_file.fileno(), destination_file.fileno(), min(chunk_size, remaining))
+                if copied == 0:
+                    break
+                remaining -= copied
+        except (AttributeError, OSError):
+            # Not available here (other OS, or across filesystems on old kernels); finish in user space
+            source_file.seek(destination_file.seek(0, os.SEEK_END))
+            shutil.copyfileobj(source_file, destination_file, chunk_size)
+    shutil.copystat(source, destination)
+
+
+def reflink_file(source, destination):
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+        fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+    shutil.copystat(source, destination)
+
+
+def is_exported(source, destination, mode):
+    """True if destination already holds this source, so the file can be skipped."""
+    try:
+        if mode == "symlink":
+            return os.path.islink(destination) and os.readlink(destination) == os.path.abspath(source)
+        if os.path.islink(destination):
+            return False
+        source_stat, destination_stat = os.stat(source), os.stat(destination)
+    except OSError:
+        return False
+    if (source_stat.st_dev, source_stat.st_ino) == (destination_stat.st_dev, destination_stat.st_ino):
+        return True
+    # Copies keep the source's mtime, so size and mtime together identify an unchanged export
+    return (source_stat.st_size == destination_stat.st_size
+            and source_stat.st_mtime_ns == destination_stat.st_mtime_ns)
+
+
+def export_file(source, destination, mode, first_copy=None):
+    """
+    Exports one file. Returns the number of bytes written to disk.
+
+    Parameters:
+    - source: Image to export.
+    - destination: Path to create.
+    - mode: One of EXPORT_MODES. hardlink and reflink fall back to a copy
+      when the filesystem can't do them.
+    - first_copy: An earlier export of the same source, which copy mode
+      hardlinks to instead of copying the data again.
+    """
+    if os.path.lexists(destination):
+        os.remove(destination)
+    if mode == "symlink":
+        os.symlink(os.path.abspath(source), destination)
+        return 0
+    if mode == "hardlink" or first_copy is not None:
+        try:
+            os.link(first_copy or source, destination)
+            return 0
+        except OSError:
+            pass  # Other filesystem, or links unsupported
+    if mode == "reflink":
+        try:
+            reflink_file(source, destination)
+            return 0
+        except OSError:
+            if os.path.exists(destination):
+                os.remove(destination)
+    copy_file(source, destination)
+    return os.path.getsize(source)
+
+
+class FolderExport:
+    """
+    Writes sorted groups out as one folder per group, off the Tk thread.
+
+    An image that belongs to several groups is read once: its first
+    destination gets the data, the others are hardlinked to it when
+    possible. Files already exported and unchanged are skipped, and files
+    are exported in parallel on a thread pool. Progress is put on `results`
+    as ("progress", done_files, total_files, bytes_written),
+    ("error", path, message) and a final ("done", cancelled).
+    """
+
+    def __init__(self, groups, output_folder, mode="copy", workers=8):
+        if mode not in EXPORT_MODES:
+            raise ValueError(f"Unknown export mode {mode!r}, expected one of {EXPORT_MODES}")
+        self.groups = groups
+        self.output_folder = output_folder
+        self.mode = mode
+        self.workers = workers
+        self.results = queue.Queue()
+        self.cancelled = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def plan(self):
+        """
+        Returns a list of (source, [destinations]), one entry per unique
+        source. Names that clash inside one group get a numbered suffix.
+        """
+        destinations = {}
+        for group_name, image_paths in self.groups.items():
+            group_folder = os.path.join(self.output_folder, group_name)
+            os.makedirs(group_folder, exist_ok=True)
+            used = set()
+            for image_path in image_paths:
+                stem, extension = os.path.splitext(os.path.basename(image_path))
+                name, number = stem + extension, 1
+                while name.lower() in used:
+                    name, number = f"{stem}_{number}{extension}", number + 1
+                used.add(name.lower())
+                destinations.setdefault(image_path, []).append(os.path.join(group_folder, name))
+        return list(destinations.items())
+
+    def export_source(self, source, destinations):
+        written, first_copy = 0, None
+        for destination in destinations:
+            if not is_exported(source, destination, self.mode):
+                written += export_file(source, destination, self.mode, first_copy)
+            if self.mode == "copy" and first_copy is None:
+                first_copy = destination
+        return written
+
+    def run(self):
+        plan = self.plan()
+        total = sum(len(destinations) for _, destinations in plan)
+        done_files, written = 0, 0
+        entries = iter(plan)
+        pending = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while not self.cancelled.is_set():
+                for source, destinations in entries:
+                    pending[pool.submit(self.export_source, source, destinations)] = (source, len(destinations))
+                    if len(pending) >= self.workers * 4:
+                        break
+                if not pending:
+                    break
+
+                completed, _ = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    source, count = pending.pop(future)
+                    done_files += count
+                    try:
+                        written += future.result()
+                    except OSError as error:
+                        self.results.put(("error", source, str(error)))
+                self.results.put(("progress", done_files, total, written))
+
+            for future in pending:
+                future.cancel()
+        self.results.put(("done", self.cancelled.is_set()))
@@ -0,0 +1,97 @@
+import os
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# Leading bytes of the formats we can open
+MAGIC_NUMBERS = (
+    b"\xff\xd8\xff",  # JPEG
+    b"\x89PNG\r\n\x1a\n",  # PNG
+    b"BM",  # BMP
+)
+
+
+def sniff_image(path):
+    """True if the file starts with the signature of a supported image format."""
+    try:
+        with open(path, "rb") as image_file:
+            head = image_file.read(8)
+    except OSError:
+        return False
+    return head.startswith(MAGIC_NUMBERS)
+
+
+class FolderScanner:
+    """
+    Finds the images under a folder in the background.
+
+    Directories are listed with os.scandir on a thread pool, so subfolders of
+    a slow (network) mount are read in parallel. Found paths are put on
+    `results` in batches as each directory is listed, ("paths", [path, ...]),
+    followed by a final ("done", cancelled), so a caller can show images while
+    the scan is still running.
+
+    With sniff=True every file is identified by its leading bytes, which also
+    finds images without a usual extension and skips mislabelled files, at the
+    cost of opening each file.
+    """
+
+    def __init__(self, folder_path, sniff=False, workers=8, batch_size=256):
+        self.folder_path = folder_path
+        self.sniff = sniff
+        self.workers = workers
+        self.batch_size = batch_size
+        self.results = queue.Queue()
+        self.cancelled = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def is_image(self, entry):
+        if self.sniff:
+            return sniff_image(entry.path)
+        return entry.name.lower().endswith(IMAGE_EXTENSIONS)
+
+    def scan_directory(self, directory):
+        """Lists one directory. Returns (image_paths, subdirectories)."""
+        image_paths, subdirectories = [], []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if self.cancelled.is_set():
+                        break
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirectories.append(entry.path)
+                        elif entry.is_file() and self.is_image(entry):
+                            image_paths.append(entry.path)
+                    except OSError:
+                        continue
+        except OSError:
+            pass  # Unreadable directories are skipped, like os.walk does
+        image_paths.sort()
+        subdirectories.sort()
+        return image_paths, subdirectories
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = {pool.submit(self.scan_directory, self.folder_path)}
+            while pending and not self.cancelled.is_set():
+                done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in done:
+                    image_paths, subdirectories = future.result()
+                    for subdirectory in subdirectories:
+                        pending.add(pool.submit(self.scan_directory, subdirectory))
+                    for start in range(0, len(image_paths), self.batch_size):
+                        self.results.put(("paths", image_paths[start:start + self.batch_size]))
+            for future in pending:
+                future.cancel()
+        self.results.put(("done", self.cancelled.is_set()))
@@ -0,0 +1,213 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import queue
+import select
+import struct
+import threading
+from folder_scanner import IMAGE_EXTENSIONS
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """Minimal ctypes binding to Linux inotify. Raises OSError where it isn't available."""
+
+    def __init__(self):
+        library = ctypes.util.find_library("c")
+        if library is None:
+            raise OSError("libc not found")
+        self.libc = ctypes.CDLL(library, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify is not supported on this platform")
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        return wd
+
+    def read_events(self, timeout):
+        """Waits up to timeout seconds. Returns a list of (wd, mask, name)."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events, position = [], 0
+        while position + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, position)
+            position += EVENT_HEADER.size
+            name = data[position:position + length].rstrip(b"\0")
+            position += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FolderWatcher:
+    """
+    Reports images added, changed or removed under a folder.
+
+    On Linux every directory is watched with inotify, and a directory is
+    re-listed only after events arrive for it. Elsewhere, or when the inotify
+    watch limit is reached, all known directories are re-listed every
+    `interval` seconds. Either way a listing is compared with the last one by
+    mtime and size, and the differences are put on `results` as
+    ("added", paths), ("changed", paths) and ("removed", paths).
+    """
+
+    def __init__(self, folder_path, interval=2.0, use_inotify=True):
+        self.folder_path = folder_path
+        self.interval = interval
+        self.use_inotify = use_inotify
+        self.results = queue.Queue()
+        self.cancelled = threading.Event()
+        self.thread = None
+        self.files = {}  # directory -> {path: (mtime_ns, size)}
+        self.subdirectories = {}  # directory -> subdirectories at the last listing
+        self.inotify = None
+        self.watches = {}  # inotify watch descriptor -> directory
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        self.cancelled.set()
+
+    @staticmethod
+    def list_directory(directory):
+        """Returns ({image path: (mtime_ns, size)}, subdirectories), or None if the directory is gone."""
+        files, subdirectories = {}, []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirectories.append(entry.path)
+                        elif entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                            stat = entry.stat()
+                            files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+                    except OSError:
+                        continue
+        except OSError:
+            return None
+        return files, subdirectories
+
+    def watch(self, directory):
+        if self.inotify is None:
+            return
+        try:
+            self.watches[self.inotify.add_watch(directory)] = directory
+        except OSError as error:
+            if error.errno in (errno.ENOSPC, errno.ENOMEM):
+                # Out of watches; polling covers every directory from here on
+                self.inotify.close()
+                self.inotify = None
+                self.watches.clear()
+
+    def forget_tree(self, directory, removed):
+        removed += self.files.pop(directory, {})
+        for subdirectory in self.subdirectories.pop(directory, []):
+            self.forget_tree(subdirectory, removed)
+
+    def rescan(self, directories, added, changed, removed, report=True):
+        """Re-lists directories, recursing into new subdirectories, and records what changed."""
+        pending = list(directories)
+        while pending:
+            directory = pending.pop()
+            previous = self.files.get(directory)
+            if previous is None:
+                # Watched before listing, so nothing created in between is missed
+                self.watch(directory)
+                previous = {}
+            listing = self.list_directory(directory)
+            if listing is None:
+                self.forget_tree(directory, removed)
+                continue
+            files, subdirectories = listing
+            if report:
+                added += [path for path in files if path not in previous]
+                changed += [path for path, key in files.items() if path in previous and previous[path] != key]
+                removed += [path for path in previous if path not in files]
+            self.files[directory] = files
+
+            for subdirectory in subdirectories:
+                if subdirectory not in self.files:
+                    pending.append(subdirectory)
+            # A subdirectory that is no longer listed was deleted or moved away
+            for subdirectory in set(self.subdirectories.get(directory, [])) - set(subdirectories):
+                self.forget_tree(subdirectory, removed)
+            self.subdirectories[directory] = subdirectories
+
+    def run(self):
+        if self.use_inotify:
+            try:
+                self.inotify = Inotify()
+            except OSError:
+                self.inotify = None
+        # The first listing is the baseline, it is not reported
+        self.rescan([self.folder_path], [], [], [], report=False)
+
+        while not self.cancelled.is_set():
+            if self.inotify is not None:
+                dirty = self.collect_events()
+            else:
+                self.cancelled.wait(self.interval)
+                dirty = list(self.files)
+            dirty = [directory for directory in dirty if directory in self.files]
+            if not dirty or self.cancelled.is_set():
+                continue
+
+            added, changed, removed = [], [], []
+            self.rescan(sorted(dirty), added, changed, removed)
+            for kind, paths in (("removed", removed), ("added", added), ("changed", changed)):
+                if paths:
+                    self.results.put((kind, sorted(paths)))
+
+        if self.inotify is not None:
+            self.inotify.close()
+
+    def collect_events(self):
+        """Waits for inotify events, then for a short quiet period, and returns the directories they touched."""
+        dirty = set()
+        timeout = 0.5
+        while not self.cancelled.is_set():
+            events = self.inotify.read_events(timeout)
+            if not events:
+                if dirty:
+                    return dirty
+                continue
+            # Copying a batch of photos fires many events, wait until they settle before re-listing
+            timeout = min(self.interval, 0.5)
+            for wd, mask, _ in events:
+                directory = self.watches.get(wd)
+                if directory is None:
+                    continue
+                dirty.add(directory)
+                if mask & (IN_DELETE_SELF | IN_IGNORED):
+                    del self.watches[wd]
+                    dirty.add(os.path.dirname(directory))
+        return dirty
@@ -1,28 +1,130 @@
+import math
+from itertools import count
+import numpy as np
 from PIL import Image
+from tiled_image import TiledImage
+
+# Shared counter so a (layer, version) pair is never reused, even across layers
+_versions = count()
+
+IDENTITY = np.array([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+
+
+def compose_transforms(outer, inner):
+    """Returns the 2x3 affine matrix that applies inner first, then outer."""
+    return (np.vstack([outer, [0, 0, 1]]) @ np.vstack([inner, [0, 0, 1]]))[:2]
+
+
+def transform_points(transform, points):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return points @ transform[:, :2].T + transform[:, 2]
+
 
 class Layer:
     def __init__(self, width, height, name="Layer"):
         self.width = width
         self.height = height
         self.name = name
-        self.image = None
+        self.tiles = None  # TiledImage backing store, None until the layer gets an image
         self.visible = True
         self.offset = [0, 0]
+        # Affine matrix from stored pixels to canvas (before offset), applied at render time;
+        # the stored pixels are never resampled
+        self.transform = IDENTITY.copy()
+        self.pyramid = []  # Mipmap levels of tiles, level n is downsampled by 2**n
         self.brush_strokes = []
+        self.version = next(_versions)
+        self.damage = []  # Canvas boxes changed since the last redraw
 
     # Add this method
     def set_offset(self, x_offset, y_offset):
+        self.mark_damaged(self.get_box())
         self.offset = [x_offset, y_offset]
+        self.mark_damaged(self.get_box())
 
 
     def update_image(self, image):
-        self.image = image
+        """Replaces the layer's pixels with a PIL image or a TiledImage."""
+        self.mark_damaged(self.get_box())
+        if image is None or isinstance(image, TiledImage):
+            self.tiles = image
+        else:
+            self.tiles = TiledImage.from_image(image)
+        if self.tiles is not None:
+            self.width, self.height = self.tiles.size
+        self.pyramid = [self.tiles] if self.tiles is not None else []
+        self.version = next(_versions)
+        self.mark_damaged(self.get_box())
+
+    def set_transform(self, transform):
+        self.mark_damaged(self.get_box())
+        self.transform = np.array(transform, dtype=np.float64)
+        self.mark_damaged(self.get_box())
+
+    def get_scale(self):
+        """Average scale of the transform (ignoring rotation)."""
+        return math.sqrt(abs(np.linalg.det(self.transform[:, :2])))
+
+    def has_transform(self):
+        return not np.array_equal(self.transform, IDENTITY)
+
+    def get_level(self, level):
+        """Returns the layer downsampled by 2**level. Levels are built once per image, on first use."""
+        while len(self.pyramid) <= level:
+            self.pyramid.append(self.pyramid[-1].downsample())
+        return self.pyramid[level]
+
+    def level_for_scale(self, scale):
+        """Smallest pyramid level that still has at least as many pixels as the displayed size."""
+        if scale >= 1 or self.tiles is None:
+            return 0
+        level = int(math.floor(math.log2(1 / scale)))
+        return max(0, min(level, int(math.log2(max(self.tiles.width, self.tiles.height, 1)))))
+
+    def has_image(self):
+        return self.tiles is not None
 
     def get_image(self):
-        return self.image
+        """Returns the layer as one PIL image. This allocates the full size, prefer get_tiles where possible."""
+        if self.tiles is None:
+            return None
+        return self.tiles.to_image()
+
+    def get_tiles(self):
+        return self.tiles
+
+    def get_size(self):
+        """Size of the stored pixels, before the transform."""
+        return self.tiles.size if self.tiles is not None else (self.width, self.height)
 
     def get_offset(self):
         return self.offset
 
+    def get_local_box(self):
+        """Box covered by the transformed pixels, relative to the offset."""
+        if self.tiles is None:
+            return None
+        width, height = self.tiles.size
+        if not self.has_transform():
+            return 0, 0, width, height
+        corners = transform_points(self.transform, [(0, 0), (width, 0), (0, height), (width, height)])
+        return (int(math.floor(corners[:, 0].min())), int(math.floor(corners[:, 1].min())),
+                int(math.ceil(corners[:, 0].max())), int(math.ceil(corners[:, 1].max())))
+
+    def get_box(self):
+        local_box = self.get_local_box()
+        if local_box is None:
+            return None
+        x_offset, y_offset = (int(v) for v in self.offset)
+        return x_offset + local_box[0], y_offset + local_box[1], x_offset + local_box[2], y_offset + local_box[3]
+
+    def mark_damaged(self, box):
+        if box is not None:
+            self.damage.append(tuple(box))
+
+    def take_damage(self):
+        damage, self.damage = self.damage, []
+        return damage
+
     def add_brush_stroke(self, stroke):
         self.brush_strokes.append(stroke)
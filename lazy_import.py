@@ -0,0 +1,92 @@
+import importlib
+import sys
+import threading
+import time
+import types
+from contextlib import contextmanager
+
+# Import this module first, so the timings below start close to process start
+STARTED = time.perf_counter()
+
+# (label, start, seconds) for every timed step, in the order they finished
+timings = []
+report_live = False  # Print timings as they happen, set by the startup report
+_lock = threading.Lock()
+
+
+def record(label, start, seconds):
+    with _lock:
+        timings.append((label, start - STARTED, seconds))
+    if report_live:
+        print(f"[startup] {label}: {seconds * 1000:.0f} ms (at {start - STARTED + seconds:.2f}s)")
+
+
+@contextmanager
+def timed(label):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(label, start, time.perf_counter() - start)
+
+
+class LazyModule(types.ModuleType):
+    """Stands in for a module and imports it on first attribute access."""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__["_module"] = None
+        self.__dict__["_load_lock"] = threading.Lock()
+
+    def _load(self):
+        with self._load_lock:
+            if self._module is None:
+                with timed(f"import {self.__name__}"):
+                    self.__dict__["_module"] = importlib.import_module(self.__name__)
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._module or self._load(), attribute)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_module(name):
+    """
+    Returns a module that is imported the first time one of its attributes
+    is used. Works for extension modules such as cv2 and dlib, which
+    importlib.util.LazyLoader can't defer. An already imported module is
+    returned as is.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
+
+def warm_up(*loaders):
+    """Runs loaders (modules to import or callables) on a background thread, so first use doesn't stall the UI."""
+    def run():
+        for loader in loaders:
+            try:
+                if isinstance(loader, LazyModule):
+                    loader._load()
+                elif not isinstance(loader, types.ModuleType):  # Real modules are loaded already
+                    loader()
+            except Exception as error:
+                print(f"Warm-up failed: {error}")
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def startup_report():
+    """Prints every step timed so far, slowest first, and keeps printing new ones as they finish."""
+    global report_live
+    with _lock:
+        rows = sorted(timings, key=lambda row: -row[2])
+    print(f"[startup] {time.perf_counter() - STARTED:.2f}s to first idle")
+    for label, start, seconds in rows:
+        print(f"[startup] {label}: {seconds * 1000:.0f} ms (at {start + seconds:.2f}s)")
+    report_live = True
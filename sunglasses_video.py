@@ -0,0 +1,195 @@
+"""
+Puts sunglasses on every face in a video.
+
+    python sunglasses_video.py clip.mp4 clip_sunglasses.mp4 --detect-every 10
+
+Faces are detected every N frames and followed with dlib's correlation
+tracker in between. Decoding, face analysis and drawing plus encoding run on
+three threads connected by bounded queues, so each stage overlaps the others.
+"""
+import argparse
+import queue
+import threading
+import time
+from facial_recognition import SunglassesFilter
+from lazy_import import lazy_module
+
+cv2 = lazy_module("cv2")
+dlib = lazy_module("dlib")
+
+_END = object()
+
+
+class SunglassesVideo:
+    """
+    Streams a video through the sunglasses filter.
+
+    Parameters:
+    - sunglasses_filter: SunglassesFilter whose face service and sprite cache are used.
+    - detect_every: Run the detector on every Nth frame and track in between.
+    - min_confidence: A tracker whose peak-to-side-lobe ratio drops below
+      this forces a new detection on the next frame.
+    - queue_size: Frames buffered between two stages.
+    """
+
+    def __init__(self, sunglasses_filter=None, detect_every=10, min_confidence=7.0, queue_size=8):
+        self.sunglasses_filter = sunglasses_filter or SunglassesFilter()
+        self.detect_every = max(1, detect_every)
+        self.min_confidence = min_confidence
+        self.queue_size = queue_size
+        self.cancelled = threading.Event()
+        self.stats = {"frames": 0, "detections": 0, "fps": 0.0}
+        self.error = None  # Raised from run when the analysis thread fails
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def put(self, target, item):
+        # Blocks while the next stage is busy, but gives up once the run is cancelled
+        while not self.cancelled.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def take(self, source):
+        while not self.cancelled.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def read_frames(self, capture, frames):
+        try:
+            while not self.cancelled.is_set():
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                self.put(frames, frame)
+        finally:
+            self.put(frames, _END)
+
+    def analyse_frames(self, frames, analysed):
+        """Finds faces per frame: detection on keyframes, correlation tracking in between."""
+        service = self.sunglasses_filter.face_analysis
+        trackers = []
+        index = 0
+        force_detection = True
+        try:
+            while not self.cancelled.is_set():
+                frame = self.take(frames)
+                if frame is _END:
+                    break
+                rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+                if force_detection or index % self.detect_every == 0:
+                    faces = service.run_detector(frame)
+                    trackers = []
+                    for face in faces:
+                        tracker = dlib.correlation_tracker()
+                        tracker.start_track(rgb, dlib.rectangle(*face))
+                        trackers.append(tracker)
+                    self.stats["detections"] += 1
+                    force_detection = False
+                else:
+                    faces, kept = [], []
+                    height, width = frame.shape[:2]
+                    for tracker in trackers:
+                        confidence = tracker.update(rgb)
+                        if confidence < self.min_confidence:
+                            force_detection = True  # Lost or drifting, detect again next frame
+                        position = tracker.get_position()
+                        # A face leaving the shot drags its box past the frame edge
+                        face = (max(int(position.left()), 0), max(int(position.top()), 0),
+                                min(int(position.right()), width), min(int(position.bottom()), height))
+                        if face[0] >= face[2] or face[1] >= face[3]:
+                            force_detection = True
+                            continue
+                        faces.append(face)
+                        kept.append(tracker)
+                    trackers = kept
+
+                landmarks = [service.predict_landmarks(frame, face) for face in faces]
+                landmarks = [points for points in landmarks if points is not None]
+                self.put(analysed, (frame, landmarks))
+                index += 1
+        except Exception as error:
+            self.error = error
+        finally:
+            self.put(analysed, _END)
+
+    def draw(self, frame, landmarks):
+        """Blends the sunglasses into a BGR frame in place, clipped at the frame border."""
+        self.sunglasses_filter.blend(frame, landmarks)
+
+    def run(self, input_path, output_path, report=print):
+        """
+        Processes a whole video.
+
+        Returns:
+        - A dict with the number of frames, keyframe detections and the
+          average frames per second.
+        """
+        self.sunglasses_filter.load_models()
+        capture = cv2.VideoCapture(input_path)
+        if not capture.isOpened():
+            raise OSError(f"Could not open video {input_path}")
+        fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+        size = (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+
+        frames = queue.Queue(maxsize=self.queue_size)
+        analysed = queue.Queue(maxsize=self.queue_size)
+        stages = [threading.Thread(target=self.read_frames, args=(capture, frames), daemon=True),
+                  threading.Thread(target=self.analyse_frames, args=(frames, analysed), daemon=True)]
+        for stage in stages:
+            stage.start()
+
+        # Drawing and encoding run here, the third stage
+        started = last_report = time.perf_counter()
+        try:
+            while not self.cancelled.is_set():
+                item = self.take(analysed)
+                if item is _END:
+                    break
+                frame, landmarks = item
+                self.draw(frame, landmarks)
+                writer.write(frame)
+                self.stats["frames"] += 1
+
+                now = time.perf_counter()
+                if now - last_report >= 1.0:
+                    report(f"{self.stats['frames']} frames, {self.stats['frames'] / (now - started):.1f} fps")
+                    last_report = now
+        finally:
+            self.cancel()
+            for stage in stages:
+                stage.join()
+            capture.release()
+            writer.release()
+        if self.error is not None:
+            raise self.error
+
+        self.stats["fps"] = self.stats["frames"] / max(time.perf_counter() - started, 1e-9)
+        return self.stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Put sunglasses on every face in a video.")
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--detect-every", type=int, default=10, help="Frames between face detections")
+    parser.add_argument("--detect-max-side", type=int, default=1024,
+                        help="Longest side frames are shrunk to for detection, 0 for full size")
+    args = parser.parse_args(argv)
+
+    sunglasses_filter = SunglassesFilter()
+    sunglasses_filter.face_analysis.detect_max_side = args.detect_max_side or None
+    stats = SunglassesVideo(sunglasses_filter, detect_every=args.detect_every).run(args.input, args.output)
+    print(f"Done: {stats['frames']} frames, {stats['detections']} detections, {stats['fps']:.1f} fps")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,26 @@
-import os
-import cv2
+# Imported first so the startup report measures everything below
+from lazy_import import STARTED, lazy_module, record, startup_report, timed, warm_up
+import queue
+import sys
+import time
 import tkinter as tk
 from tkinter import filedialog, simpledialog, Button, Toplevel, Scale, HORIZONTAL, ttk, messagebox
 from PIL import Image, ImageTk, ImageDraw
 import numpy as np
 from tools import ScaleTool, TranslateTool, DrawTool, HistoryTool, RotateTool
-from layer import Layer
-from filter import Filter
+from layer import Layer, compose_transforms, transform_points
+from filter import FILTERS, Filter
+from filter_job import FilterJob
+from blur_preview import BlurPreview, proxy_level
+from compositor import LayerCompositor
+from tiled_image import TiledImage
 from facial_recognition import SunglassesFilter
 from Planner import ImagePlannerApp
+from folder_scanner import FolderScanner
+from thumbnail_cache import ThumbnailCache
+from thumbnail_grid import ThumbnailGrid
+
+cv2 = lazy_module("cv2")
 
 
 class ImageResizerApp:
@@ -68,6 +80,14 @@ class ImageResizerApp:
         filter_button.pack(pady=5)
 # Sunglasses --------------
 
+        # Every registered filter gets a button; blur has its own popup with a live preview
+        for name, kernel in FILTERS.items():
+            if name == "blur":
+                continue
+            registered_filter_button = tk.Button(self.filters_frame, text=kernel.label,
+                                                 command=lambda name=name: self.apply_registered_filter_with_popup(name))
+            registered_filter_button.pack(fill="x", padx=10, pady=5)
+
 
 
         self.canvas = tk.Canvas(self.main_frame, bg="gray")
@@ -86,6 +106,9 @@ class ImageResizerApp:
         self.scale_button = tk.Button(self.button_panel, text="Scale Image", command=self.toggle_scaling)
         self.scale_button.pack(side="left", padx=10, pady=10)
 
+        self.rotate_button = tk.Button(self.button_panel, text="Rotate Image", command=self.toggle_rotation)
+        self.rotate_button.pack(side="left", padx=10, pady=10)
+
         self.translate_button = tk.Button(self.button_panel, text="Translate Image", command=self.toggle_translation)
         self.translate_button.pack(side="left", padx=10, pady=10)
 
@@ -101,28 +124,41 @@ class ImageResizerApp:
 
 # Initialize tools ----------
         self.scale_tool = ScaleTool()
+        self.rotate_tool = RotateTool()
         self.translate_tool = TranslateTool()
         self.draw_tool = DrawTool()
         self.history_tool = HistoryTool()
         self.filter_tool = Filter()
+        self.compositor = LayerCompositor()
 
 # Variables -----------------
         self.layers = []
+        self.active_layer_index = -1
+        self.composite_photo = None
         self.image = None
         self.original_image = None
-        self.scale_factor = 1.0
         self.scaling = False
+        self.rotating = False
         self.drawing = False
         self.translating = False
         self.brush_strokes = []
         self.offset = [0, 0]
         self.sunglasses_filter = SunglassesFilter()
+        self.image_paths = []
+        self.thumbnail_grid = None
+        self.scanner = None
 
 
         self.canvas.bind("<ButtonPress-1>", self.start_action)
         self.canvas.bind("<B1-Motion>", self.perform_action)
         self.canvas.bind("<ButtonRelease-1>", self.end_action)
         self.canvas.bind("<Configure>", self.on_resize)
+        self.canvas.bind("<MouseWheel>", self.on_scroll)
+        self.canvas.bind("<Shift-MouseWheel>", self.on_scroll)
+        self.canvas.bind("<Button-4>", self.on_scroll)
+        self.canvas.bind("<Button-5>", self.on_scroll)
+        self.canvas.bind("<Shift-Button-4>", self.on_scroll)
+        self.canvas.bind("<Shift-Button-5>", self.on_scroll)
         self.layer_listbox.bind("<<ListboxSelect>>", self.on_layer_select)
 
 
@@ -131,58 +167,65 @@ class ImageResizerApp:
     def load_folder(self):
         folder_path = filedialog.askdirectory()
         if folder_path:
+            if self.scanner is not None:
+                self.scanner.cancel()
             self.image_paths.clear()
-            for root, _, files in os.walk(folder_path):
-                for file in files:
-                    if file.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp')):
-                        self.image_paths.append(os.path.join(root, file))
-            messagebox.showinfo("Success", f"Loaded {len(self.image_paths)} images from folder.")
             self.display_images()
+            # Scanned in the background, the grid fills in while subfolders are still being listed
+            self.scanner = FolderScanner(folder_path).start()
+            self.root.after(50, self.poll_scan_results, self.scanner)
+
+    def poll_scan_results(self, scanner):
+        if scanner is not self.scanner or not self.thumbnail_grid.canvas.winfo_exists():
+            scanner.cancel()  # Replaced by a newer folder, or the browser window was closed
+            return
+        found = []
+        while True:
+            try:
+                message = scanner.results.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == "done":
+                self.scanner = None
+                self.image_paths.extend(found)
+                self.thumbnail_grid.add_paths(found)
+                if not message[1]:
+                    messagebox.showinfo("Success", f"Loaded {len(self.image_paths)} images from folder.")
+                return
+            found += message[1]
+
+        if found:
+            self.image_paths.extend(found)
+            self.thumbnail_grid.add_paths(found)
+        self.root.after(100, self.poll_scan_results, scanner)
 
     def display_images(self):
-        self.image_canvas.delete("all")
-        self.thumbnails.clear()
-        self.image_position_mapping.clear()
-
-        x, y = 10, 10
-        for image_path in self.image_paths:
-            image = Image.open(image_path)
-            image.thumbnail((100, 100))
-            photo = ImageTk.PhotoImage(image)
-            image_id = self.image_canvas.create_image(x, y, anchor="nw", image=photo, tags="thumbnail")
-            self.thumbnails.append(photo)
-            self.image_position_mapping[image_id] = image_path
-
-            x += 110
-            if x > self.root.winfo_width() - 110:
-                x = 10
-                y += 110
-
-    def on_image_click(self, event):
-        # Get the ID of the clicked item on the canvas
-        clicked_item = self.image_canvas.find_withtag("current")
-
-        # Check if the clicked item has the "thumbnail" tag
-        if clicked_item and "thumbnail" in self.image_canvas.gettags(clicked_item[0]):
-            # Retrieve the image path corresponding to the clicked thumbnail
-            image_path = self.image_position_mapping.get(clicked_item[0])
-            if image_path:
-                # Call the main app's method to load the selected image
-                self.main_app.load_image_from_path(image_path)
-        else:
-            print("Click ignored. Only thumbnails can load images.")
+        # The grid lives in its own window, created on first use and reused while it stays open
+        if self.thumbnail_grid is None or not self.thumbnail_grid.canvas.winfo_exists():
+            browser_window = Toplevel(self.root)
+            browser_window.title("Folder")
+            browser_window.geometry("800x600")
+            self.thumbnail_grid = ThumbnailGrid(browser_window, on_click=self.on_image_click,
+                                                cache=ThumbnailCache(size=100))
+        self.thumbnail_grid.set_paths(self.image_paths)
+
+    def on_image_click(self, image_path):
+        # Only thumbnails report clicks, so any path here can be loaded
+        self.load_image_from_path(image_path)
 
 
     def open_image_planner(self):
         planner_window = Toplevel(self.root)
         image_planner_app = ImagePlannerApp(planner_window, main_app=self)
 
-    def load_image_from_path(self, image_path):
+    def load_image_from_path(self, image_path, faces=None):
+        """faces: optional (left, top, right, bottom) boxes already found in the image, e.g. by the Planner."""
         if image_path:
             self.image = cv2.imread(image_path)
             if self.image is not None:
+                if faces:
+                    self.sunglasses_filter.face_analysis.store_faces(self.image, faces)
                 self.original_image = self.image.copy()
-                self.scale_factor = 1.0
                 self.image_offset = [0, 0]
                 self.brush_strokes.clear()
 
@@ -191,7 +234,7 @@ class ImageResizerApp:
                 # Add a white base layer
                 if len(self.layers) == 0 or self.layers[0].name != "Base Layer":
                     base_layer = Layer(image_width, image_height, name="Base Layer")
-                    base_image = Image.new("RGBA", (image_width, image_height), (255, 255, 255, 255))
+                    base_image = TiledImage.filled(image_width, image_height, (255, 255, 255, 255))
                     base_layer.update_image(base_image)
                     self.layers.insert(0, base_layer)  # First layer as base.
 
@@ -218,14 +261,13 @@ class ImageResizerApp:
             self.image = cv2.imread(file_path)
             if self.image is not None:
                 self.original_image = self.image.copy()
-                self.scale_factor = 1.0
                 self.image_offset = [0, 0]
                 self.brush_strokes.clear()
 
                 image_height, image_width = self.image.shape[:2]
                 if len(self.layers) == 0 or self.layers[0].name != "Base Layer":
                     base_layer = Layer(image_width, image_height, name="Base Layer")
-                    base_image = Image.new("RGBA", (image_width, image_height), (255, 255, 255, 255))
+                    base_image = TiledImage.filled(image_width, image_height, (255, 255, 255, 255))
                     base_layer.update_image(base_image)
                     self.layers.insert(0, base_layer)
 
@@ -250,7 +292,7 @@ class ImageResizerApp:
             width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
 
         new_layer = Layer(width, height, name=f"Layer {len(self.layers) + 1}")
-        transparent_image = Image.new("RGBA", (width, height), (255, 255, 255, 0))
+        transparent_image = TiledImage(width, height)  # No tiles are allocated until something is painted
         new_layer.update_image(transparent_image)
 
         self.layers.append(new_layer)
@@ -332,7 +374,7 @@ class ImageResizerApp:
             base_layer = None
             if len(self.layers) > 0 and self.layers[0].name == "Base Layer":
                 base_layer = self.layers[0]
-                previous_base_layer_size = base_layer.get_image().size
+                previous_base_layer_size = base_layer.get_size()
             else:
                 previous_base_layer_size = (previous_width, previous_height)
 
@@ -341,7 +383,7 @@ class ImageResizerApp:
             self.root.geometry(f"{new_width}x{new_height + 100}")  # +100 for buttons space
 
             if base_layer:
-                base_image = Image.new("RGBA", (new_width, new_height), (255, 255, 255, 255))
+                base_image = TiledImage.filled(new_width, new_height, (255, 255, 255, 255))
                 base_layer.update_image(base_image)
 
             action_type = "resize_canvas"
@@ -355,16 +397,53 @@ class ImageResizerApp:
             self.history_tool.record_action(action_type, params)
             self.display_layers()
 
+    def get_viewport(self):
+        """Canvas box currently visible in the window."""
+        x1 = int(self.canvas.canvasx(0))
+        y1 = int(self.canvas.canvasy(0))
+        width = max(self.canvas.winfo_width(), self.canvas.winfo_reqwidth())
+        height = max(self.canvas.winfo_height(), self.canvas.winfo_reqheight())
+        return x1, y1, x1 + width, y1 + height
+
     def display_layers(self):
         self.canvas.delete("all")
         for layer in self.layers:
-            if layer.visible and layer.image is not None:
-                layer_image = ImageTk.PhotoImage(layer.get_image())
-                x_offset, y_offset = layer.get_offset()
-                self.canvas.create_image(x_offset, y_offset, anchor="nw", image=layer_image)
-                layer.tk_image = layer_image  # Store the image reference to prevent garbage collection
+            layer.take_damage()  # Everything is redrawn below
+        # Only the visible part is rendered; layers below and above the active one come from the compositor cache
+        composite, origin = self.compositor.composite(self.layers, self.active_layer_index, self.get_viewport())
+        if composite is not None:
+            self.composite_photo = ImageTk.PhotoImage(composite)  # Keep reference to avoid garbage collection
+            self.canvas.create_image(origin[0], origin[1], anchor="nw", image=self.composite_photo)
         self.draw_brush_strokes()
-        self.canvas.config(scrollregion=self.canvas.bbox("all"))
+        # The canvas only holds the visible part, so the scroll region comes from the layers themselves
+        scrollregion = self.compositor.union_box([self.compositor.extent(self.layers), self.canvas.bbox("strokes")])
+        if scrollregion is not None:
+            self.canvas.config(scrollregion=scrollregion)
+
+    def on_scroll(self, event):
+        if len(self.layers) == 0:
+            return
+        step = -1 if event.num == 4 or getattr(event, "delta", 0) > 0 else 1
+        if event.state & 0x0001:  # Shift scrolls horizontally
+            self.canvas.xview_scroll(step, "units")
+        else:
+            self.canvas.yview_scroll(step, "units")
+        self.display_layers()
+
+    def refresh_layers(self):
+        """Push only the damaged boxes of the layers to the canvas, or redraw everything if needed."""
+        damage = [box for layer in self.layers for box in layer.take_damage()]
+        if not damage:
+            return
+        regions = self.compositor.update_regions(self.layers, self.active_layer_index, damage, self.get_viewport())
+        if regions is None or self.composite_photo is None:
+            self.display_layers()
+            return
+
+        for region, (x, y) in regions:
+            region_photo = ImageTk.PhotoImage(region)
+            self.canvas.tk.call(str(self.composite_photo), "copy", str(region_photo),
+                                "-to", x, y, "-compositingrule", "set")
 
     def on_layer_select(self, event):
         selection = self.layer_listbox.curselection()
@@ -383,10 +462,14 @@ class ImageResizerApp:
 
         final_image = Image.new("RGBA", (canvas_width, canvas_height), (255, 255, 255, 0))
 
-        for layer in self.layers:
-            if layer.visible and layer.image is not None:
-                x_offset, y_offset = layer.offset
-                final_image.alpha_composite(layer.get_image(), dest=(x_offset, y_offset))
+        # Rendered in blocks, so transformed layers are resampled one block at a time; empty tiles are skipped
+        block = 2048
+        for y in range(0, canvas_height, block):
+            for x in range(0, canvas_width, block):
+                for layer in self.layers:
+                    if layer.visible and layer.has_image():
+                        self.compositor.render_layer(layer, final_image, (0, 0), box=(x, y, x + block, y + block),
+                                                     interpolation=cv2.INTER_LANCZOS4)
 
 
         final_image_draw = ImageDraw.Draw(final_image)
@@ -412,22 +495,27 @@ class ImageResizerApp:
         """Draw all brush strokes on the canvas from all layers."""
         self.canvas.delete("strokes")
 
+        for layer in self.layers:
+            if layer.visible:
+                for stroke in layer.brush_strokes:
+                    for i in range(1, len(stroke.points)):
+                        self.draw_stroke_segment(layer, stroke, i)
+
+    def draw_stroke_segment(self, layer, stroke, index):
+        """Draw the segment of a stroke that ends at points[index]."""
         # Get scroll offsets in pixels
         x_scroll_offset = self.canvas.xview()[0] * self.canvas.winfo_width()
         y_scroll_offset = self.canvas.yview()[0] * self.canvas.winfo_height()
 
-        for layer in self.layers:
-            if layer.visible:
-                for stroke in layer.brush_strokes:
-                    if len(stroke.points) > 1:
-                        for i in range(1, len(stroke.points)):
-                            x1 = stroke.points[i - 1][0] * self.scale_factor + layer.offset[0] - x_scroll_offset
-                            y1 = stroke.points[i - 1][1] * self.scale_factor + layer.offset[1] - y_scroll_offset
-                            x2 = stroke.points[i][0] * self.scale_factor + layer.offset[0] - x_scroll_offset
-                            y2 = stroke.points[i][1] * self.scale_factor + layer.offset[1] - y_scroll_offset
-                            self.canvas.create_line(
-                                x1, y1, x2, y2, fill=stroke.color, width=stroke.width, tags="strokes"
-                            )
+        # Points are in the layer's own pixels, so they follow its transform
+        (x1, y1), (x2, y2) = transform_points(layer.transform, stroke.points[index - 1:index + 1])
+        x1 += layer.offset[0] - x_scroll_offset
+        y1 += layer.offset[1] - y_scroll_offset
+        x2 += layer.offset[0] - x_scroll_offset
+        y2 += layer.offset[1] - y_scroll_offset
+        self.canvas.create_line(
+            x1, y1, x2, y2, fill=stroke.color, width=stroke.width, tags="strokes"
+        )
 
     def on_resize(self, event):
         if len(self.layers) > 0:
@@ -438,22 +526,33 @@ class ImageResizerApp:
         self.scaling = not self.scaling
         self.drawing = False
         self.translating = False
+        self.rotating = False
+        self.update_button_texts()
+
+    def toggle_rotation(self):
+        self.rotating = not self.rotating
+        self.scaling = False
+        self.drawing = False
+        self.translating = False
         self.update_button_texts()
 
     def toggle_drawing(self):
         self.drawing = not self.drawing
         self.scaling = False
         self.translating = False
+        self.rotating = False
         self.update_button_texts()
 
     def toggle_translation(self):
         self.translating = not self.translating
         self.drawing = False
         self.scaling = False
+        self.rotating = False
         self.update_button_texts()
 
     def update_button_texts(self):
         self.scale_button.config(text="Scaling Mode: ON" if self.scaling else "Scaling Mode: OFF")
+        self.rotate_button.config(text="Rotate Mode: ON" if self.rotating else "Rotate Mode: OFF")
         self.draw_button.config(text="Draw Mode: ON" if self.drawing else "Draw Mode: OFF")
         self.translate_button.config(text="Translate Mode: ON" if self.translating else "Translate Mode: OFF")
 
@@ -468,18 +567,18 @@ class ImageResizerApp:
         active_layer = self.layers[self.active_layer_index]
 
         if self.scaling:
-            self.previous_scale = self.scale_factor
+            self.previous_transform = active_layer.transform.copy()
             self.scale_tool.start_action(event)
         elif self.translating:
             self.previous_offset = active_layer.offset[:]
             self.translate_tool.start_action(event, active_layer.offset)
         elif self.drawing:
-            self.current_stroke = self.draw_tool.start_action(event, active_layer.offset, self.scale_factor)
+            self.current_stroke = self.draw_tool.start_action(event, active_layer.offset, active_layer.transform)
             active_layer.brush_strokes.append(self.current_stroke)
 
         elif self.rotating:
             self.rotate_tool.start_action(event)
-            self.previous_angle = self.angle
+            self.previous_transform = active_layer.transform.copy()
 
 
     def perform_action(self, event):
@@ -488,17 +587,28 @@ class ImageResizerApp:
 
         active_layer = self.layers[self.active_layer_index]
 
-        if self.scaling and self.original_image is not None:
-            # Perform scaling for the active layer
-            self.image, self.scale_factor = self.scale_tool.perform_action(event, self.original_image,
-                                                                           self.scale_factor)
-            active_layer.update_image(Image.fromarray(cv2.cvtColor(self.image, cv2.COLOR_BGR2RGBA)))
-            self.display_layers()
+        if self.scaling and active_layer.has_image():
+            # Perform scaling for the active layer, only its matrix changes and the visible part is resampled
+            active_layer.set_transform(self.scale_tool.perform_action(event, active_layer.transform))
+            self.refresh_layers()
+            if active_layer.brush_strokes:
+                self.draw_brush_strokes()
+
+        elif self.rotating and active_layer.has_image():
+            active_layer.set_transform(
+                self.rotate_tool.perform_action(event, active_layer.transform, active_layer.get_size())
+            )
+            self.refresh_layers()
+            if active_layer.brush_strokes:
+                self.draw_brush_strokes()
 
         elif self.translating:
             # Perform the translation for the active layer
-            self.translate_tool.perform_action(event, active_layer.offset)
-            self.display_layers()  # Redraw the entire canvas to reflect changes in positions
+            _, damage = self.translate_tool.perform_action(event, active_layer.offset, active_layer.get_local_box())
+            active_layer.mark_damaged(damage)
+            self.refresh_layers()  # Only the boxes the layer left and entered are re-blended
+            if active_layer.brush_strokes:
+                self.draw_brush_strokes()
 
         elif self.drawing:
             # Get scroll offsets in pixels
@@ -506,14 +616,19 @@ class ImageResizerApp:
             y_scroll_offset = self.canvas.yview()[0] * self.canvas.winfo_height()
 
             # Adjust the drawing logic to account for the scroll offsets
-            self.draw_tool.perform_action(
+            damage = self.draw_tool.perform_action(
                 event,
                 active_layer.offset,
-                self.scale_factor,
+                active_layer.transform,
                 x_scroll_offset,
                 y_scroll_offset,
             )
-            self.display_layers()  # Redraw the canvas to reflect changes
+            # Strokes are canvas items, so only the new segment has to be added
+            self.draw_stroke_segment(active_layer, self.current_stroke, len(self.current_stroke.points) - 1)
+            scrollregion = [float(v) for v in self.canvas.cget("scrollregion").split()] or [0, 0, 0, 0]
+            if (damage[0] < scrollregion[0] or damage[1] < scrollregion[1]
+                    or damage[2] > scrollregion[2] or damage[3] > scrollregion[3]):
+                self.canvas.config(scrollregion=self.canvas.bbox("all"))
 
 
 
@@ -527,8 +642,17 @@ class ImageResizerApp:
             # Record the scaling action for undo/redo
             action_type = "scale"
             params = {
-                "previous_scale": self.previous_scale,  # The original scale factor before scaling
-                "new_scale": self.scale_factor,  # The new scale factor after scaling
+                "previous_transform": self.previous_transform,  # The layer's matrix before scaling
+                "new_transform": active_layer.transform.copy(),  # The matrix after scaling
+                "layer_index": self.active_layer_index
+            }
+            self.history_tool.record_action(action_type, params)
+
+        elif self.rotating:
+            action_type = "rotate"
+            params = {
+                "previous_transform": self.previous_transform,
+                "new_transform": active_layer.transform.copy(),
                 "layer_index": self.active_layer_index
             }
             self.history_tool.record_action(action_type, params)
@@ -572,15 +696,15 @@ class ImageResizerApp:
             return
 
         image_cv = cv2.cvtColor(np.array(active_image), cv2.COLOR_RGBA2BGR)
-        sunglasses_layer_cv = self.sunglasses_filter.apply_filter(image_cv)
-        sunglasses_layer_pil = Image.fromarray(sunglasses_layer_cv)
+        # Only the tiles under each pair of sunglasses are allocated
+        sunglasses_tiles = TiledImage(active_image.width, active_image.height)
+        for x, y, patch in self.sunglasses_filter.render_patches(image_cv):
+            sunglasses_tiles.alpha_composite(patch, (x, y))
 
         new_layer = Layer(active_image.width, active_image.height, name="Sunglasses Layer")
-        new_layer.update_image(sunglasses_layer_pil)
-        new_layer.offset = [
-            int(active_layer.offset[0] * self.scale_factor),
-            int(active_layer.offset[1] * self.scale_factor),
-        ]
+        new_layer.update_image(sunglasses_tiles)
+        new_layer.offset = active_layer.offset[:]
+        new_layer.transform = active_layer.transform.copy()
 
         self.layers.append(new_layer)
         self.active_layer_index = len(self.layers) - 1
@@ -599,62 +723,95 @@ class ImageResizerApp:
     def apply_blur_filter_with_popup(self):
         if self.active_layer_index == -1:
             return
+        active_layer = self.layers[self.active_layer_index]
+        if not active_layer.has_image():
+            return
+        self.previous_image = active_layer.get_tiles().copy()  # Shares tiles, no pixels are copied
+        previous_transform = active_layer.transform.copy()
+
+        # Previews are computed on a pyramid level no bigger than the screen and drawn scaled up
+        level = proxy_level(active_layer.get_size(), active_layer.get_scale(),
+                            max(self.root.winfo_screenwidth(), self.root.winfo_screenheight()))
+        proxy_transform = compose_transforms(previous_transform, np.array([[2.0 ** level, 0.0, 0.0],
+                                                                           [0.0, 2.0 ** level, 0.0]]))
+        preview = BlurPreview(self.previous_image, active_layer.get_level(level), 0.5 ** level).start()
 
         # Create a popup window
         popup = Toplevel(self.root)
         popup.title("Adjust Blur Strength")
         popup.geometry("300x150")
 
+        def show(image, transform):
+            active_layer.update_image(image)
+            active_layer.set_transform(transform)
+            self.refresh_layers()
+
+        def request_preview():
+            popup.pending_preview = None
+            strength = blur_slider.get()
+            if strength > 0:
+                preview.request(strength)
+            else:
+                preview.cancel_pending()  # A blur still running must not replace the original
+                show(self.previous_image, previous_transform)
+
+        def on_slider(value):
+            # Debounced: a drag produces many events, only the last one is computed
+            if popup.pending_preview is not None:
+                popup.after_cancel(popup.pending_preview)
+            popup.pending_preview = popup.after(40, request_preview)
+
         # Add a slider to adjust the blur strength
-        blur_slider = Scale(popup, from_=0, to=20, orient=HORIZONTAL, label="Blur Strength")
+        popup.pending_preview = None
+        blur_slider = Scale(popup, from_=0, to=50, orient=HORIZONTAL, label="Blur Strength", command=on_slider)
         blur_slider.set(0)  # Set initial value to 0 (no blur)
         blur_slider.pack(fill="x", padx=10, pady=10)
 
-        def preview_blur():
-            if self.active_layer_index != -1:
-                active_layer = self.layers[self.active_layer_index]
-                if active_layer.image is not None:
-                    kernel_size = blur_slider.get()
-                    if kernel_size > 0:
-                        rgba_image = active_layer.get_image()
-                        rgb_image = rgba_image.convert("RGB")  # Remove alpha temporarily for OpenCV
-                        alpha_channel = rgba_image.split()[-1]  # Extract alpha channel
-
-                        # Convert to OpenCV
-                        cv_rgb = cv2.cvtColor(np.array(rgb_image), cv2.COLOR_RGB2BGR)
-                        cv_alpha = np.array(alpha_channel)
-
-                        # Apply Gaussian blur to RGB and alpha channels
-                        blurred_rgb = cv2.GaussianBlur(cv_rgb, (kernel_size * 2 + 1, kernel_size * 2 + 1), 0)
-                        blurred_alpha = cv2.GaussianBlur(cv_alpha, (kernel_size * 2 + 1, kernel_size * 2 + 1), 0)
-
-                        # Convert back to PIL and restore the alpha channel
-                        blurred_image = Image.fromarray(cv2.cvtColor(blurred_rgb, cv2.COLOR_BGR2RGB))
-                        blurred_alpha_channel = Image.fromarray(blurred_alpha).convert("L")
-                        final_image = Image.merge("RGBA", (*blurred_image.split(), blurred_alpha_channel))
-
-                        active_layer.update_image(final_image)
-                    else:
-                        active_layer.update_image(self.previous_image)
-                    self.display_layers()
+        def poll_preview():
+            if not popup.winfo_exists():
+                return
+            while True:
+                try:
+                    message = preview.results.get_nowait()
+                except queue.Empty:
+                    break
+                if message[0] == "error":
+                    print(f"Blur failed: {message[1]}")
+                elif message[0] == "preview":
+                    if message[1] == blur_slider.get():
+                        show(message[2], proxy_transform)
+                else:
+                    finish_blur(message[2])
+                    return
+            popup.after(30, poll_preview)
 
         def apply_blur():
-            preview_blur()
+            strength = blur_slider.get()
+            if strength == 0:
+                cancel_blur()
+                return
+            # Only now is the blur computed at full resolution
+            apply_button.config(state="disabled")
+            blur_slider.config(state="disabled")
+            popup.title("Applying blur...")
+            preview.apply(strength)
+
+        def finish_blur(blurred):
+            preview.cancel()
+            show(blurred, previous_transform)
             popup.destroy()
 
             action_type = "filter"
             params = {
-                "layer_index": self.active_layer_index,
+                "layer_index": self.layers.index(active_layer),
                 "previous_image": self.previous_image,
-                "new_image": self.layers[self.active_layer_index].get_image().copy()
+                "new_image": blurred.copy()
             }
             self.history_tool.record_action(action_type, params)
 
         def cancel_blur():
-
-            if self.active_layer_index != -1:
-                self.layers[self.active_layer_index].update_image(self.previous_image)
-                self.display_layers()
+            preview.cancel()
+            show(self.previous_image, previous_transform)
             popup.destroy()
 
         apply_button = Button(popup, text="Apply", command=apply_blur)
@@ -663,11 +820,79 @@ class ImageResizerApp:
         cancel_button = Button(popup, text="Cancel", command=cancel_blur)
         cancel_button.pack(side="right", padx=10, pady=10)
 
-        blur_slider.bind("<Motion>", lambda event: preview_blur())
+        popup.protocol("WM_DELETE_WINDOW", cancel_blur)
+        popup.after(30, poll_preview)
 
-        if self.active_layer_index != -1:
-            active_layer = self.layers[self.active_layer_index]
-            self.previous_image = active_layer.get_image().copy()
+
+    def apply_registered_filter_with_popup(self, name):
+        if self.active_layer_index == -1:
+            return
+        active_layer = self.layers[self.active_layer_index]
+        if not active_layer.has_image():
+            return
+        kernel = FILTERS[name]
+
+        popup = Toplevel(self.root)
+        popup.title(kernel.label)
+        popup.job = None
+
+        # One slider per parameter
+        sliders = {}
+        for parameter, default, minimum, maximum in kernel.parameters:
+            slider = Scale(popup, from_=minimum, to=maximum, resolution=1 if isinstance(default, int) else 0.1,
+                           orient=HORIZONTAL, label=parameter.replace("_", " ").capitalize())
+            slider.set(default)
+            slider.pack(fill="x", padx=10, pady=5)
+            sliders[parameter] = slider
+
+        def apply_filter():
+            parameters = kernel.convert({parameter: slider.get() for parameter, slider in sliders.items()})
+            previous_image = active_layer.get_tiles().copy()  # Shares tiles, no pixels are copied
+            # Tiles are filtered in parallel off the UI thread
+            popup.job = FilterJob(previous_image, [(name, parameters)]).start()
+            apply_button.config(state="disabled")
+            popup.title(f"Applying {kernel.label}...")
+            poll_filter(popup.job, previous_image)
+
+        def poll_filter(job, previous_image):
+            if job.cancelled.is_set():
+                return
+            try:
+                message = job.results.get_nowait()
+            except queue.Empty:
+                self.root.after(50, lambda: poll_filter(job, previous_image))
+                return
+            if popup.winfo_exists():
+                popup.destroy()
+            if message[0] == "error":
+                print(f"{kernel.label} failed: {message[1]}")
+                return
+            if active_layer not in self.layers:
+                return
+
+            active_layer.update_image(message[1])
+            self.refresh_layers()
+
+            action_type = "filter"
+            params = {
+                "layer_index": self.layers.index(active_layer),
+                "previous_image": previous_image,
+                "new_image": message[1].copy()
+            }
+            self.history_tool.record_action(action_type, params)
+
+        def cancel_filter():
+            if popup.job is not None:
+                popup.job.cancel()
+            popup.destroy()
+
+        apply_button = Button(popup, text="Apply", command=apply_filter)
+        apply_button.pack(side="left", padx=10, pady=10)
+
+        cancel_button = Button(popup, text="Cancel", command=cancel_filter)
+        cancel_button.pack(side="right", padx=10, pady=10)
+
+        popup.protocol("WM_DELETE_WINDOW", cancel_filter)
 
 
 #--------------------------------------------------------------------------------------
@@ -691,16 +916,17 @@ class ImageResizerApp:
             self.root.geometry(f"{previous_width}x{previous_height + 100}")
             if len(self.layers) > 0 and self.layers[0].name == "Base Layer":
                 self.layers[0].update_image(
-                    Image.new("RGBA", action["params"]["previous_base_layer_size"], (255, 255, 255, 255))
+                    TiledImage.filled(*action["params"]["previous_base_layer_size"], (255, 255, 255, 255))
                 )
             self.display_layers()
 
         elif action["type"] == "filter" or action["type"] == "apply_filter":
             layer_index = action["params"]["layer_index"]
-            previous_image = action["params"]["previous_image"]
+            delta = action["params"]["delta"]  # Only the changed pixels are kept in the history
 
             if layer_index < len(self.layers):
-                self.layers[layer_index].update_image(previous_image)
+                layer = self.layers[layer_index]
+                layer.update_image(delta.apply(layer.get_tiles(), previous=True))
                 self.display_layers()
 
         elif action["type"] == "add_layer":
@@ -723,12 +949,10 @@ class ImageResizerApp:
             self.update_layer_listbox()
             self.display_layers()
 
-        elif action["type"] == "scale":
+        elif action["type"] == "scale" or action["type"] == "rotate":
+            # Transforms are only matrices, nothing is resampled
             layer_index = action["params"]["layer_index"]
-            self.scale_factor = action["params"]["previous_scale"]
-            self.layers[layer_index].update_image(
-                Image.fromarray(cv2.cvtColor(self.original_image, cv2.COLOR_BGR2RGBA))
-            )
+            self.layers[layer_index].set_transform(action["params"]["previous_transform"])
             self.display_layers()
 
         elif action["type"] == "translate":
@@ -766,15 +990,16 @@ class ImageResizerApp:
             self.root.geometry(f"{previous_width}x{previous_height + 100}")
             if len(self.layers) > 0 and self.layers[0].name == "Base Layer":
                 self.layers[0].update_image(
-                    Image.new("RGBA", action["params"]["previous_base_layer_size"], (255, 255, 255, 255))
+                    TiledImage.filled(*action["params"]["previous_base_layer_size"], (255, 255, 255, 255))
                 )
             self.display_layers()
 
         elif action["type"] == "filter":
             layer_index = action["params"]["layer_index"]
-            new_image = action["params"]["new_image"]
+            delta = action["params"]["delta"]
             if layer_index < len(self.layers):
-                self.layers[layer_index].update_image(new_image)
+                layer = self.layers[layer_index]
+                layer.update_image(delta.apply(layer.get_tiles(), previous=False))
                 self.display_layers()
 
         elif action["type"] == "add_layer":
@@ -787,26 +1012,10 @@ class ImageResizerApp:
                 self.update_layer_listbox()
                 self.display_layers()
 
-        elif action["type"] == "scale":
+        elif action["type"] == "scale" or action["type"] == "rotate":
             layer_index = action["params"]["layer_index"]
-            new_scale = action["params"]["new_scale"]
-            previous_scale = action["params"]["previous_scale"]
-
-            active_layer = self.layers[layer_index]
-            if active_layer.image is not None:
-                scaled_width = int(active_layer.get_image().width * new_scale / previous_scale)
-                scaled_height = int(active_layer.get_image().height * new_scale / previous_scale)
-
-                scaled_image = active_layer.get_image().resize(
-                    (scaled_width, scaled_height), Image.Resampling.LANCZOS
-                )
-                active_layer.update_image(scaled_image)
-
-                active_layer.offset[0] = int(active_layer.offset[0] * new_scale / previous_scale)
-                active_layer.offset[1] = int(active_layer.offset[1] * new_scale / previous_scale)
-
-                self.scale_factor = new_scale
-                self.display_layers()
+            self.layers[layer_index].set_transform(action["params"]["new_transform"])
+            self.display_layers()
 
         elif action["type"] == "translate":
             layer_index = action["params"]["layer_index"]
@@ -818,14 +1027,6 @@ class ImageResizerApp:
             self.layers[layer_index].add_brush_stroke(action["params"]["stroke"])
             self.display_layers()
 
-        elif action["type"] == "rotate":
-            layer_index = action["params"]["layer_index"]
-            new_angle = action["params"]["new_angle"]
-            self.angle = new_angle
-            rotated_image = self.rotate_tool.perform_action(None, self.original_image, self.angle)[0]
-            self.layers[layer_index].update_image(Image.fromarray(cv2.cvtColor(rotated_image, cv2.COLOR_BGR2RGBA)))
-            self.display_layers()
-
         elif action["type"] == "apply_sunglasses":
             layer_index = action["params"]["layer_index"]
             layer_data = action["params"]["layer_data"]
@@ -836,6 +1037,14 @@ class ImageResizerApp:
             print("Redo: Restored sunglasses layer.")
 
 
-root = tk.Tk()
-app = ImageResizerApp(root)
-root.mainloop()
+if __name__ == "__main__":
+    record("import modules", STARTED, time.perf_counter() - STARTED)
+    with timed("create window"):
+        root = tk.Tk()
+    with timed("build editor"):
+        app = ImageResizerApp(root)
+    # OpenCV and the landmark model load in the background once the window is up, not before it
+    root.after_idle(lambda: warm_up(cv2, app.sunglasses_filter.load_models))
+    if "--startup-report" in sys.argv:
+        root.after_idle(startup_report)
+    root.mainloop()
@@ -0,0 +1,50 @@
+import os
+import sys
+import tracemalloc
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from face_clustering import FaceClusterer  # noqa: E402
+
+
+def people_encodings(people, faces_per_person, seed=0):
+    """Synthetic encodings: unit-length centers with every face about 0.15 away from its person's center."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(people, 128))
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    encodings = np.repeat(centers, faces_per_person, axis=0)
+    encodings += rng.normal(size=encodings.shape) * (0.15 / np.sqrt(128))
+    order = rng.permutation(len(encodings))
+    return encodings[order], np.repeat(np.arange(people), faces_per_person)[order]
+
+
+class LargeClusterTest(unittest.TestCase):
+    def test_few_large_clusters(self):
+        encodings, people = people_encodings(people=3, faces_per_person=2000)
+        clusterer = FaceClusterer()
+
+        tracemalloc.start()
+        indptr, indices, weights = clusterer.graph(encodings)
+        labels = clusterer.cluster(encodings)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        # The graph grows with the number of faces, not with the square of a cluster's size
+        self.assertLessEqual(len(indices), clusterer.neighbors * len(encodings))
+        self.assertEqual(indices.dtype, np.int32)
+        self.assertLess(peak, 100 * 1024 * 1024)
+
+        self.assertEqual(len(set(labels)), 3)
+        for person in range(3):
+            self.assertEqual(len(set(labels[people == person])), 1)
+
+    def test_far_apart_faces_stay_apart(self):
+        encodings = np.eye(4, 128) * 5
+        self.assertEqual(sorted(FaceClusterer().cluster(encodings)), [0, 1, 2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
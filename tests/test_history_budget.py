@@ -0,0 +1,40 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools import HistoryTool  # noqa: E402
+
+
+class SizedHistory(HistoryTool):
+    """Entries weigh whatever their "bytes" parameter says, instead of their pixel data."""
+
+    @staticmethod
+    def entry_size(params):
+        return params.get("bytes", 0)
+
+
+class BudgetTest(unittest.TestCase):
+    def test_oldest_undo_entries_are_dropped(self):
+        history = SizedHistory(max_bytes=100)
+        for number in range(5):
+            history.record_action("filter", {"number": number, "bytes": 30})
+
+        self.assertEqual([action["params"]["number"] for action in history.undo_stack], [2, 3, 4])
+        self.assertLessEqual(history.memory_usage(), 100)
+
+    def test_redo_entries_count_against_the_budget(self):
+        history = SizedHistory(max_bytes=100, spill_to_disk=True)
+        for number in range(3):
+            history.record_action("filter", {"number": number, "bytes": 40})
+        for _ in range(3):
+            history.undo()  # Brings the spilled first entry back into memory
+
+        self.assertLessEqual(history.memory_usage(), 100)
+        # Every entry can still be redone, the furthest one from disk
+        self.assertEqual([history.redo()["params"]["number"] for _ in range(3)], [0, 1, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import sys
+import unittest
+from concurrent.futures import Future
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from thumbnail_grid import ThumbnailGrid  # noqa: E402
+
+
+class FakeCanvas:
+    """Just enough of tk.Canvas for ThumbnailGrid, without a display."""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.next_item = 0
+
+    def bind(self, sequence, callback):
+        pass
+
+    def after(self, delay, callback, *args):
+        pass
+
+    after_idle = after
+
+    def config(self, **options):
+        pass
+
+    def yview_moveto(self, fraction):
+        pass
+
+    def canvasy(self, y):
+        return y
+
+    def winfo_width(self):
+        return self.width
+
+    def winfo_height(self):
+        return self.height
+
+    def create_rectangle(self, *args, **kwargs):
+        self.next_item += 1
+        return self.next_item
+
+    create_image = create_rectangle
+
+    def delete(self, item):
+        pass
+
+
+class FakePool:
+    """Records which thumbnails were requested; the futures never run."""
+
+    def __init__(self):
+        self.requested = []
+
+    def submit(self, function, image_path, *args):
+        self.requested.append(image_path)
+        return Future()
+
+
+def make_grid():
+    # 230 px wide: two 110 px columns; 300 px high: every row of a small grid is on screen
+    return ThumbnailGrid(None, canvas=FakeCanvas(width=230, height=300), pool=FakePool())
+
+
+class RefreshTest(unittest.TestCase):
+    def test_failed_path_does_not_stop_refresh(self):
+        grid = make_grid()
+        grid.failed.add("bad.jpg")
+        grid.photos["a.jpg"] = object()
+
+        grid.set_paths(["a.jpg", "bad.jpg", "c.jpg", "d.jpg"])
+
+        self.assertEqual(sorted(grid.items), [0, 1, 2, 3])
+        self.assertEqual(grid.pool.requested, ["c.jpg", "d.jpg"])
+
+    def test_shown_photo_becomes_most_recent(self):
+        grid = make_grid()
+        grid.photos["a.jpg"] = object()
+        grid.photos["other.jpg"] = object()
+
+        grid.set_paths(["a.jpg", "b.jpg"])
+
+        self.assertEqual(list(grid.photos), ["other.jpg", "a.jpg"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import hashlib
+import io
+import os
+import tempfile
+from PIL import ExifTags, Image
+
+DEFAULT_THUMBNAIL_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ikt213", "thumbnails")
+
+# EXIF tags in IFD1 giving the embedded JPEG thumbnail's position and length
+JPEG_INTERCHANGE_FORMAT = 0x0201
+JPEG_INTERCHANGE_FORMAT_LENGTH = 0x0202
+
+
+def exif_thumbnail(image):
+    """Returns the JPEG thumbnail embedded in an image's EXIF data as a PIL image, or None."""
+    raw = image.info.get("exif")
+    if not raw:
+        return None
+    try:
+        ifd1 = image.getexif().get_ifd(ExifTags.IFD.IFD1)
+        offset, length = ifd1.get(JPEG_INTERCHANGE_FORMAT), ifd1.get(JPEG_INTERCHANGE_FORMAT_LENGTH)
+        if not offset or not length:
+            return None
+        # Offsets count from the TIFF header, which follows the "Exif\0\0" marker
+        start = offset + (6 if raw.startswith(b"Exif\x00\x00") else 0)
+        thumbnail = Image.open(io.BytesIO(raw[start:start + length]))
+        thumbnail.load()
+        return thumbnail
+    except Exception:
+        return None  # A broken EXIF block only costs us the fast path
+
+
+def decode_thumbnail(image_path, size):
+    """
+    Decodes an image straight to thumbnail size, as cheaply as the format allows.
+
+    An embedded EXIF thumbnail is used when it is big enough and has the same
+    aspect ratio as the photo. Otherwise JPEGs are decoded with DCT scaling
+    (Image.draft), which skips most of the work of a full-size decode.
+
+    Parameters:
+    - image_path: Image file to read.
+    - size: Longest side of the thumbnail.
+
+    Returns:
+    - A PIL image in RGB or RGBA mode, no larger than size x size.
+    """
+    with Image.open(image_path) as image:
+        if image.format == "JPEG":
+            embedded = exif_thumbnail(image)
+            if (embedded is not None and max(embedded.size) >= min(size, max(image.size))
+                    and abs(embedded.width / embedded.height - image.width / image.height) < 0.02):
+                image = embedded
+            else:
+                image.draft("RGB", (size, size))
+        image.thumbnail((size, size))
+        return image.convert("RGBA") if image.mode not in ("RGB", "RGBA") else image.copy()
+
+
+class ThumbnailCache:
+    """
+    Directory of ready-made thumbnails, one small PNG per image.
+
+    Files are named by a hash of the source path, its mtime and size and the
+    thumbnail size, so an edited photo gets a new entry and stale entries are
+    never read. Writes go through a temporary file and a rename, so several
+    threads can fill the cache at once.
+    """
+
+    def __init__(self, directory=DEFAULT_THUMBNAIL_DIR, size=100):
+        self.directory = directory
+        self.size = size
+        os.makedirs(directory, exist_ok=True)
+
+    def entry_path(self, image_path):
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+        key = f"{os.path.abspath(image_path)}\0{stat.st_mtime_ns}\0{stat.st_size}\0{self.size}"
+        digest = hashlib.sha1(key.encode("utf-8", "surrogateescape")).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest[2:] + ".png")
+
+    def get(self, image_path):
+        entry = self.entry_path(image_path)
+        if entry is None or not os.path.exists(entry):
+            return None
+        try:
+            with Image.open(entry) as thumbnail:
+                thumbnail.load()
+                return thumbnail.copy()
+        except OSError:
+            return None
+
+    def put(self, image_path, thumbnail):
+        entry = self.entry_path(image_path)
+        if entry is None:
+            return
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        handle, temporary_path = tempfile.mkstemp(dir=os.path.dirname(entry), suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as temporary_file:
+                thumbnail.save(temporary_file, "PNG", compress_level=1)
+            os.replace(temporary_path, entry)
+        except OSError:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+    def load(self, image_path):
+        """Returns the thumbnail for an image, decoding and storing it on a miss."""
+        thumbnail = self.get(image_path)
+        if thumbnail is None:
+            thumbnail = decode_thumbnail(image_path, self.size)
+            self.put(image_path, thumbnail)
+        return thumbnail
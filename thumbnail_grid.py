@@ -0,0 +1,211 @@
+import os
+import queue
+import tkinter as tk
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import ImageTk
+from thumbnail_cache import decode_thumbnail
+
+
+def load_thumbnail(image_path, size, cache=None):
+    """Runs on a worker thread: returns one thumbnail, from the cache when there is one."""
+    if cache is not None:
+        return cache.load(image_path)
+    return decode_thumbnail(image_path, size)
+
+
+class ThumbnailGrid:
+    """
+    Scrollable grid of image thumbnails for folders of any size.
+
+    Only the rows on screen (plus one row either side) have canvas items.
+    Thumbnails are decoded on a thread pool and painted in from the Tk loop as
+    they finish; requests for cells that scroll away before starting are
+    cancelled. Decoded PhotoImages are kept in a bounded LRU cache, and an
+    optional ThumbnailCache keeps the decoded thumbnails on disk between runs.
+    """
+
+    def __init__(self, parent, on_click=None, thumb_size=100, padding=10, workers=None, max_cached=1000,
+                 cache=None, canvas=None, pool=None):
+        """
+        canvas and pool replace the Canvas (with its scrollbar) and the decoding
+        thread pool the grid would otherwise create, e.g. to run without a display.
+        """
+        self.on_click = on_click
+        self.cache = cache
+        self.thumb_size = thumb_size
+        self.padding = padding
+        self.cell_size = thumb_size + padding
+        self.max_cached = max_cached
+
+        self.scrollbar = None
+        self.canvas = canvas if canvas is not None else self.build_canvas(parent)
+        self.canvas.bind("<Configure>", lambda event: self.layout())
+        self.canvas.bind("<Button-1>", self.on_canvas_click)
+        self.canvas.bind("<MouseWheel>", lambda event: self.canvas.yview_scroll(-1 if event.delta > 0 else 1, "units"))
+        self.canvas.bind("<Button-4>", lambda event: self.canvas.yview_scroll(-1, "units"))
+        self.canvas.bind("<Button-5>", lambda event: self.canvas.yview_scroll(1, "units"))
+
+        self.pool = pool or ThreadPoolExecutor(max_workers=workers or min(8, os.cpu_count() or 1))
+        self.finished = queue.Queue()
+        self.loading = {}  # path -> future
+        self.photos = OrderedDict()  # path -> PhotoImage, least recently shown first
+        self.failed = set()  # Paths that could not be decoded, not retried
+        self.paths = []
+        self.columns = 1
+        self.items = {}  # grid index -> canvas item
+        self.item_paths = {}  # canvas item -> path
+        self.polling = False
+        self.refresh_pending = False
+
+    def build_canvas(self, parent):
+        self.scrollbar = tk.Scrollbar(parent, orient="vertical")
+        self.scrollbar.pack(side="right", fill="y")
+        canvas = tk.Canvas(parent, bg="white", yscrollcommand=self.on_yscroll)
+        canvas.pack(side="left", fill="both", expand=True)
+        self.scrollbar.config(command=canvas.yview)
+        return canvas
+
+    def set_paths(self, image_paths):
+        self.paths = list(image_paths)
+        self.canvas.delete("all")
+        self.items.clear()
+        self.item_paths.clear()
+        self.canvas.yview_moveto(0)
+        self.layout()
+
+    def add_paths(self, image_paths):
+        """Appends images to the grid without redrawing the ones already shown."""
+        self.paths.extend(image_paths)
+        self.update_scroll_region()
+        self.refresh()
+
+    def remove_paths(self, image_paths):
+        image_paths = set(image_paths)
+        self.paths = [path for path in self.paths if path not in image_paths]
+        self.forget(image_paths)
+        self.layout()
+
+    def forget(self, image_paths):
+        """Drops decoded thumbnails, so changed images are decoded again when next shown."""
+        for image_path in image_paths:
+            self.photos.pop(image_path, None)
+            self.failed.discard(image_path)
+
+    def update_scroll_region(self):
+        width = max(self.canvas.winfo_width(), self.cell_size + self.padding)
+        self.columns = max(1, (width - self.padding) // self.cell_size)
+        rows = -(-len(self.paths) // self.columns)
+        self.canvas.config(scrollregion=(0, 0, width, rows * self.cell_size + self.padding))
+
+    def layout(self):
+        self.update_scroll_region()
+        # Column count may have changed, so every cell moves
+        self.canvas.delete("all")
+        self.items.clear()
+        self.item_paths.clear()
+        self.refresh()
+
+    def on_yscroll(self, first, last):
+        if self.scrollbar is not None:
+            self.scrollbar.set(first, last)
+        # Scrolling fires this many times per frame, refresh once when the loop is idle
+        if not self.refresh_pending:
+            self.refresh_pending = True
+            self.canvas.after_idle(self.refresh)
+
+    def cell_position(self, index):
+        row, column = divmod(index, self.columns)
+        return self.padding + column * self.cell_size, self.padding + row * self.cell_size
+
+    def visible_range(self):
+        top = self.canvas.canvasy(0)
+        bottom = self.canvas.canvasy(self.canvas.winfo_height())
+        first_row = max(0, int(top // self.cell_size) - 1)
+        last_row = int(bottom // self.cell_size) + 1
+        return first_row * self.columns, min(len(self.paths), (last_row + 1) * self.columns)
+
+    def refresh(self):
+        self.refresh_pending = False
+        start, stop = self.visible_range()
+
+        for index in [index for index in self.items if not start <= index < stop]:
+            item = self.items.pop(index)
+            self.item_paths.pop(item, None)
+            self.canvas.delete(item)
+
+        wanted = set()
+        for index in range(start, stop):
+            image_path = self.paths[index]
+            wanted.add(image_path)
+            if index not in self.items:
+                self.create_item(index)
+            if image_path not in self.photos and image_path not in self.failed:
+                self.request(image_path)
+            elif image_path in self.photos:
+                self.photos.move_to_end(image_path)
+
+        # Requests for cells that left the screen are dropped if no worker has started them
+        for image_path in [path for path in self.loading if path not in wanted]:
+            if self.loading[image_path].cancel():
+                del self.loading[image_path]
+
+    def create_item(self, index):
+        image_path = self.paths[index]
+        x, y = self.cell_position(index)
+        photo = self.photos.get(image_path)
+        if photo is not None:
+            item = self.canvas.create_image(x, y, anchor="nw", image=photo, tags="thumbnail")
+        else:
+            item = self.canvas.create_rectangle(x, y, x + self.thumb_size, y + self.thumb_size,
+                                                outline="lightgray", fill="#f4f4f4", tags="thumbnail")
+        self.items[index] = item
+        self.item_paths[item] = image_path
+
+    def request(self, image_path):
+        if image_path in self.loading:
+            return
+        future = self.pool.submit(load_thumbnail, image_path, self.thumb_size, self.cache)
+        future.add_done_callback(lambda done: self.finished.put((image_path, done)))
+        self.loading[image_path] = future
+        if not self.polling:
+            self.polling = True
+            self.canvas.after(30, self.poll)
+
+    def poll(self):
+        painted = set()
+        while True:
+            try:
+                image_path, future = self.finished.get_nowait()
+            except queue.Empty:
+                break
+            if self.loading.get(image_path) is not future:
+                continue  # Superseded or cancelled
+            del self.loading[image_path]
+            try:
+                self.photos[image_path] = ImageTk.PhotoImage(future.result())
+            except Exception as error:
+                print(f"Could not load thumbnail for {image_path}: {error}")
+                self.failed.add(image_path)
+                continue
+            painted.add(image_path)
+
+        while len(self.photos) > self.max_cached:
+            self.photos.popitem(last=False)
+        if painted:
+            for index, item in list(self.items.items()):
+                if self.paths[index] in painted:
+                    self.canvas.delete(item)
+                    self.item_paths.pop(item, None)
+                    self.create_item(index)
+
+        if self.loading:
+            self.canvas.after(30, self.poll)
+        else:
+            self.polling = False
+
+    def on_canvas_click(self, event):
+        clicked_item = self.canvas.find_withtag("current")
+        image_path = self.item_paths.get(clicked_item[0]) if clicked_item else None
+        if image_path and self.on_click is not None:
+            self.on_click(image_path)
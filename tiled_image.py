@@ -0,0 +1,241 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from PIL import Image
+
+TILE_SIZE = 256
+
+# Fully transparent tiles are never stored; these are shared by every reader
+_empty_tiles = {}
+
+
+def empty_tile(width, height):
+    key = (width, height)
+    if key not in _empty_tiles:
+        _empty_tiles[key] = Image.new("RGBA", key, (0, 0, 0, 0))
+    return _empty_tiles[key]
+
+
+def is_empty(image):
+    return image.getextrema()[3][1] == 0
+
+
+class TiledImage:
+    """
+    RGBA image stored as lazily allocated square tiles.
+
+    Only tiles that hold at least one non-transparent pixel are kept, so a
+    blank layer costs nothing and memory grows with the painted area rather
+    than the canvas size. Stored tiles are never modified in place: every
+    write replaces the tile object, which makes copy() a cheap dict copy and
+    lets two TiledImages share unchanged tiles.
+    """
+
+    def __init__(self, width, height, tile_size=TILE_SIZE):
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.tiles = {}  # (column, row) -> RGBA tile
+
+    @classmethod
+    def from_image(cls, image, tile_size=TILE_SIZE):
+        tiled = cls(image.width, image.height, tile_size)
+        tiled.paste(image.convert("RGBA"), (0, 0))
+        return tiled
+
+    @classmethod
+    def filled(cls, width, height, color, tile_size=TILE_SIZE):
+        """Creates an image of one solid color; every full tile shares the same object."""
+        tiled = cls(width, height, tile_size)
+        if color[3] == 0:
+            return tiled
+        shared = {}
+        for key in tiled.tile_keys((0, 0, width, height)):
+            tile_size_key = tiled.tile_box(key)[2:]
+            if tile_size_key not in shared:
+                shared[tile_size_key] = Image.new("RGBA", tile_size_key, color)
+            tiled.tiles[key] = shared[tile_size_key]
+        return tiled
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    def copy(self):
+        copied = TiledImage(self.width, self.height, self.tile_size)
+        copied.tiles = dict(self.tiles)
+        return copied
+
+    def tile_keys(self, box):
+        """Keys of every tile position (stored or not) that intersects box, clipped to the image."""
+        x1, y1 = max(box[0], 0), max(box[1], 0)
+        x2, y2 = min(box[2], self.width), min(box[3], self.height)
+        if x1 >= x2 or y1 >= y2:
+            return []
+        size = self.tile_size
+        return [(column, row)
+                for row in range(y1 // size, (y2 - 1) // size + 1)
+                for column in range(x1 // size, (x2 - 1) // size + 1)]
+
+    def tile_box(self, key):
+        """Returns (x, y, width, height) of a tile position."""
+        x, y = key[0] * self.tile_size, key[1] * self.tile_size
+        return x, y, min(self.tile_size, self.width - x), min(self.tile_size, self.height - y)
+
+    def get_tile(self, key):
+        tile = self.tiles.get(key)
+        if tile is None:
+            _, _, width, height = self.tile_box(key)
+            return empty_tile(width, height)
+        return tile
+
+    def set_tile(self, key, tile):
+        if tile is None or is_empty(tile):
+            self.tiles.pop(key, None)
+        else:
+            self.tiles[key] = tile
+
+    def stored_tiles(self, box=None):
+        """Yields (key, tile) for every stored tile, optionally only those intersecting box."""
+        if box is None:
+            yield from list(self.tiles.items())
+            return
+        for key in self.tile_keys(box):
+            tile = self.tiles.get(key)
+            if tile is not None:
+                yield key, tile
+
+    def bbox(self):
+        """Bounding box of the stored tiles, or None if the image is empty."""
+        if not self.tiles:
+            return None
+        boxes = [self.tile_box(key) for key in self.tiles]
+        return (min(box[0] for box in boxes), min(box[1] for box in boxes),
+                max(box[0] + box[2] for box in boxes), max(box[1] + box[3] for box in boxes))
+
+    def crop(self, box):
+        """
+        Returns the given region as a PIL image.
+
+        Parameters:
+        - box: (x1, y1, x2, y2) region, may reach outside the image.
+
+        Returns:
+        - A PIL.Image RGBA object, transparent wherever no tile is stored.
+        """
+        x1, y1, x2, y2 = (int(v) for v in box)
+        region = Image.new("RGBA", (x2 - x1, y2 - y1), (0, 0, 0, 0))
+        for key, tile in self.stored_tiles(box):
+            tile_x, tile_y, _, _ = self.tile_box(key)
+            region.paste(tile, (tile_x - x1, tile_y - y1))
+        return region
+
+    def composite_onto(self, target, dest=(0, 0), box=None):
+        """
+        Alpha-composites the stored tiles onto a PIL RGBA image.
+
+        Parameters:
+        - target: PIL.Image to draw into.
+        - dest: Position of this image's top-left corner in target.
+        - box: Optional region of this image to limit the work to.
+        """
+        if box is None:
+            box = (-dest[0], -dest[1], target.width - dest[0], target.height - dest[1])
+        for key, tile in self.stored_tiles(box):
+            tile_x, tile_y, width, height = self.tile_box(key)
+            # Clip the tile to the box and the target, PIL refuses negative destinations
+            x1 = max(tile_x, box[0], -dest[0])
+            y1 = max(tile_y, box[1], -dest[1])
+            x2 = min(tile_x + width, box[2], target.width - dest[0])
+            y2 = min(tile_y + height, box[3], target.height - dest[1])
+            if x1 >= x2 or y1 >= y2:
+                continue
+            target.alpha_composite(tile, dest=(x1 + dest[0], y1 + dest[1]),
+                                   source=(x1 - tile_x, y1 - tile_y, x2 - tile_x, y2 - tile_y))
+
+    def paste(self, image, dest=(0, 0)):
+        """Writes a PIL image into the tiles, replacing the pixels it covers (alpha included)."""
+        image = image.convert("RGBA")
+        box = (dest[0], dest[1], dest[0] + image.width, dest[1] + image.height)
+        for key in self.tile_keys(box):
+            tile_x, tile_y, width, height = self.tile_box(key)
+            if box[0] <= tile_x and box[1] <= tile_y and box[2] >= tile_x + width and box[3] >= tile_y + height:
+                tile = image.crop((tile_x - dest[0], tile_y - dest[1],
+                                   tile_x - dest[0] + width, tile_y - dest[1] + height))
+            else:
+                tile = self.get_tile(key).copy()
+                tile.paste(image, (dest[0] - tile_x, dest[1] - tile_y))
+            self.set_tile(key, tile)
+
+    def alpha_composite(self, image, dest=(0, 0)):
+        """Composites a PIL image over the tiles it covers; it may reach outside the image."""
+        image = image.convert("RGBA")
+        box = (dest[0], dest[1], dest[0] + image.width, dest[1] + image.height)
+        for key in self.tile_keys(box):
+            tile_x, tile_y, width, height = self.tile_box(key)
+            x1, y1 = max(box[0], tile_x), max(box[1], tile_y)
+            x2, y2 = min(box[2], tile_x + width), min(box[3], tile_y + height)
+            tile = self.get_tile(key).copy()
+            tile.alpha_composite(image, dest=(x1 - tile_x, y1 - tile_y),
+                                 source=(x1 - dest[0], y1 - dest[1], x2 - dest[0], y2 - dest[1]))
+            self.set_tile(key, tile)
+
+    def to_image(self):
+        return self.crop((0, 0, self.width, self.height))
+
+    def map_tiles(self, function, halo=0, workers=1):
+        """
+        Applies a filter tile by tile.
+
+        Parameters:
+        - function: Callable taking and returning a PIL RGBA image of the same size.
+        - halo: How far (in pixels) the filter reads around each output pixel.
+          Each tile is processed with this much surrounding context.
+        - workers: Threads to run tiles on. At most twice this many tiles are
+          in flight, so memory stays bounded on huge images.
+
+        Returns:
+        - A new TiledImage. Empty tiles far enough from painted ones are skipped.
+        """
+        result = TiledImage(self.width, self.height, self.tile_size)
+        reach = -(-halo // self.tile_size)
+        keys = set()
+        for column, row in self.tiles:
+            for d_row in range(-reach, reach + 1):
+                for d_column in range(-reach, reach + 1):
+                    keys.add((column + d_column, row + d_row))
+
+        if workers <= 1:
+            for key in sorted(keys):
+                result.set_tile(key, self.map_tile(function, key, halo))
+            return result
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = {}
+            for key in sorted(keys):
+                if len(pending) >= workers * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        result.set_tile(pending.pop(future), future.result())
+                pending[pool.submit(self.map_tile, function, key, halo)] = key
+            for future, key in pending.items():
+                result.set_tile(key, future.result())
+        return result
+
+    def map_tile(self, function, key, halo):
+        """Runs function over one tile plus its halo and returns the filtered tile, or None if out of bounds."""
+        tile_x, tile_y, width, height = self.tile_box(key)
+        if width <= 0 or height <= 0 or tile_x < 0 or tile_y < 0:
+            return None
+        # Clamp the halo to the image so borders are handled like a whole-image filter would
+        x1, y1 = max(tile_x - halo, 0), max(tile_y - halo, 0)
+        x2, y2 = min(tile_x + width + halo, self.width), min(tile_y + height + halo, self.height)
+        filtered = function(self.crop((x1, y1, x2, y2)))
+        return filtered.convert("RGBA").crop((tile_x - x1, tile_y - y1, tile_x - x1 + width, tile_y - y1 + height))
+
+    def downsample(self):
+        """Returns a half-size copy, built tile by tile (one mipmap level down)."""
+        half = TiledImage(-(-self.width // 2), -(-self.height // 2), self.tile_size)
+        for key in sorted({(column // 2, row // 2) for column, row in self.tiles}):
+            x, y, width, height = half.tile_box(key)
+            source = self.crop((x * 2, y * 2, (x + width) * 2, (y + height) * 2))
+            half.set_tile(key, source.reduce(2))
+        return half
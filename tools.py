@@ -1,5 +1,15 @@
-import cv2
+import math
+import pickle
+import tempfile
+import zlib
+import numpy as np
+from PIL import Image
 from drawable_object import DrawableObject
+from layer import Layer, compose_transforms, transform_points
+from tiled_image import TiledImage
+from lazy_import import lazy_module
+
+cv2 = lazy_module("cv2")
 
 class Tool:
     def start_action(self, event, *args, **kwargs):
@@ -20,22 +30,21 @@ class ScaleTool(Tool):
     def start_action(self, event, *args, **kwargs):
         self.start_x, self.start_y = event.x, event.y
 
-    def perform_action(self, event, original_image, scale_factor):
+    def perform_action(self, event, transform):
+        # Only the matrix changes here, the layer is resampled at render time
         dx = event.x - self.start_x
         dy = event.y - self.start_y
         scale_change = 1 + (dx - dy) / 200
 
+        scale_factor = math.sqrt(abs(np.linalg.det(transform[:, :2])))
         new_scale_factor = scale_factor * scale_change
         new_scale_factor = max(0.1, min(new_scale_factor, 5.0))
 
-        new_width = int(original_image.shape[1] * new_scale_factor)
-        new_height = int(original_image.shape[0] * new_scale_factor)
-        resized_image = cv2.resize(original_image, (new_width, new_height), interpolation=cv2.INTER_AREA)
-
         self.start_x = event.x
         self.start_y = event.y
 
-        return resized_image, new_scale_factor
+        # Scale about the layer's offset
+        return transform * (new_scale_factor / scale_factor)
 
 
 class TranslateTool:
@@ -49,35 +58,57 @@ class TranslateTool:
         self.start_y = event.y
         self.start_image_offset = image_offset[:]
 
-    def perform_action(self, event, image_offset):
+    def perform_action(self, event, image_offset, image_box=None):
+        """image_box is the box the image covers relative to its offset, used to report the damaged box."""
         if image_offset is None:
             image_offset = [0, 0]
 
+        previous_offset = image_offset[:]
         dx = event.x - self.start_x
         dy = event.y - self.start_y
 
         image_offset[0] = self.start_image_offset[0] + dx
         image_offset[1] = self.start_image_offset[1] + dy
 
-        return image_offset
+        # Damaged box: where the image was plus where it is now
+        damage = None
+        if image_box is not None:
+            damage = (min(previous_offset[0], image_offset[0]) + image_box[0],
+                      min(previous_offset[1], image_offset[1]) + image_box[1],
+                      max(previous_offset[0], image_offset[0]) + image_box[2],
+                      max(previous_offset[1], image_offset[1]) + image_box[3])
+
+        return image_offset, damage
 
 class DrawTool(Tool):
     def __init__(self):
         self.current_stroke = None
 
-    def start_action(self, event, image_offset, scale_factor, x_scroll_offset=0, y_scroll_offset=0):
-        x = (event.x + x_scroll_offset - image_offset[0]) / scale_factor
-        y = (event.y + y_scroll_offset - image_offset[1]) / scale_factor
+    @staticmethod
+    def to_layer(event, image_offset, transform, x_scroll_offset, y_scroll_offset):
+        # Points are stored in the layer's own pixels, so they follow its transform
+        inverse = cv2.invertAffineTransform(transform)
+        point = transform_points(inverse, [(event.x + x_scroll_offset - image_offset[0],
+                                            event.y + y_scroll_offset - image_offset[1])])[0]
+        return float(point[0]), float(point[1])
+
+    def start_action(self, event, image_offset, transform, x_scroll_offset=0, y_scroll_offset=0):
+        x, y = self.to_layer(event, image_offset, transform, x_scroll_offset, y_scroll_offset)
         # Start a new stroke
         self.current_stroke = DrawableObject(points=[(x, y)])
         return self.current_stroke
 
-    def perform_action(self, event, image_offset, scale_factor, x_scroll_offset=0, y_scroll_offset=0):
-        x = (event.x + x_scroll_offset - image_offset[0]) / scale_factor
-        y = (event.y + y_scroll_offset - image_offset[1]) / scale_factor
+    def perform_action(self, event, image_offset, transform, x_scroll_offset=0, y_scroll_offset=0):
+        x, y = self.to_layer(event, image_offset, transform, x_scroll_offset, y_scroll_offset)
         # Add the new point to the current stroke
         self.current_stroke.points.append((x, y))
 
+        # Damaged box of the new segment, in canvas coordinates
+        segment = transform_points(transform, self.current_stroke.points[-2:])
+        pad = self.current_stroke.width
+        return (segment[:, 0].min() + image_offset[0] - pad, segment[:, 1].min() + image_offset[1] - pad,
+                segment[:, 0].max() + image_offset[0] + pad, segment[:, 1].max() + image_offset[1] + pad)
+
 
 class LassoTool(Tool):
     def __init__(self):
@@ -99,39 +130,214 @@ class LassoTool(Tool):
 
 
 # ---------------- UNDO REDO --------------------#
+# Undo history budget, entries beyond it are dropped (or spilled to disk) oldest first
+HISTORY_MAX_BYTES = 256 * 1024 * 1024
+
+
+class PixelDelta:
+    """
+    Pixels that differ between two TiledImages of a layer, for undo/redo.
+
+    Only tiles whose objects differ are compared, and for each of those only
+    the bounding box of the changed pixels is kept, zlib-compressed, in both
+    its before and after state.
+    """
+
+    def __init__(self, previous, new):
+        self.previous_size = previous.size
+        self.new_size = new.size
+        self.tile_size = new.tile_size
+        self.tiles = []  # (key, box, previous_bytes, new_bytes)
+
+        for key in sorted(set(previous.tiles) | set(new.tiles)):
+            if previous.tiles.get(key) is new.tiles.get(key):
+                continue  # Shared tile, untouched by the filter
+            before = np.asarray(previous.get_tile(key))
+            after = np.asarray(new.get_tile(key))
+            if before.shape != after.shape:
+                box = (0, 0, max(before.shape[1], after.shape[1]), max(before.shape[0], after.shape[0]))
+            else:
+                changed = np.any(before != after, axis=2)
+                if not changed.any():
+                    continue
+                rows = np.flatnonzero(changed.any(axis=1))
+                columns = np.flatnonzero(changed.any(axis=0))
+                box = (int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1)
+            self.tiles.append((key, box, self.pack_region(previous, key, box), self.pack_region(new, key, box)))
+
+    @staticmethod
+    def pack_region(tiled, key, box):
+        region = tiled.get_tile(key).crop(box)
+        return zlib.compress(region.tobytes(), 1)
+
+    @property
+    def nbytes(self):
+        return sum(len(before) + len(after) for _, _, before, after in self.tiles)
+
+    def apply(self, tiled, previous=True):
+        """
+        Returns a copy of tiled with the before (previous=True) or after
+        state of every changed region written back.
+        """
+        width, height = self.previous_size if previous else self.new_size
+        result = TiledImage(width, height, self.tile_size)
+        result.tiles = {key: tile for key, tile in tiled.tiles.items() if result.tile_box(key)[2] > 0
+                        and result.tile_box(key)[3] > 0}
+        for key, box, before, after in self.tiles:
+            _, _, tile_width, tile_height = result.tile_box(key)
+            if tile_width <= 0 or tile_height <= 0:
+                continue
+            region = Image.frombytes("RGBA", (box[2] - box[0], box[3] - box[1]),
+                                     zlib.decompress(before if previous else after))
+            tile = result.get_tile(key)
+            if tile.size != (tile_width, tile_height):
+                tile = tile.crop((0, 0, tile_width, tile_height))
+            else:
+                tile = tile.copy()
+            tile.paste(region, box[:2])
+            result.set_tile(key, tile)
+        return result
+
+
+class PackedLayer:
+    """A deleted or removed Layer kept in the history with its tiles zlib-compressed."""
+
+    def __init__(self, layer):
+        self.name = layer.name
+        self.width, self.height = layer.get_size()
+        self.visible = layer.visible
+        self.offset = layer.offset[:]
+        self.transform = layer.transform.copy()
+        self.brush_strokes = layer.brush_strokes
+        self.tile_size = None
+        self.tiles = None
+        if layer.has_image():
+            tiles = layer.get_tiles()
+            self.tile_size = tiles.tile_size
+            self.tiles = {key: (tile.size, zlib.compress(tile.tobytes(), 1)) for key, tile in tiles.tiles.items()}
+
+    @property
+    def nbytes(self):
+        return sum(len(data) for _, data in self.tiles.values()) if self.tiles else 0
+
+    def unpack(self):
+        layer = Layer(self.width, self.height, name=self.name)
+        if self.tiles is not None:
+            tiles = TiledImage(self.width, self.height, self.tile_size)
+            for key, (size, data) in self.tiles.items():
+                tiles.tiles[key] = Image.frombytes("RGBA", size, zlib.decompress(data))
+            layer.update_image(tiles)
+        layer.visible = self.visible
+        layer.offset = self.offset[:]
+        layer.transform = self.transform.copy()
+        layer.brush_strokes = self.brush_strokes
+        return layer
+
+
 class HistoryTool(Tool):
-    def __init__(self):
+    def __init__(self, max_bytes=HISTORY_MAX_BYTES, spill_to_disk=False):
+        """
+        Parameters:
+        - max_bytes: Budget for the compressed pixel data held in memory.
+        - spill_to_disk: If True, the oldest entries over budget are moved to a
+          temporary file instead of being dropped.
+        """
         self.undo_stack = []
         self.redo_stack = []
+        self.max_bytes = max_bytes
+        self.spill_to_disk = spill_to_disk
+        self.spill_file = None
+
+    @staticmethod
+    def pack_params(params):
+        """Replaces image copies and Layer objects with their compressed forms."""
+        packed = dict(params)
+        if isinstance(packed.get("previous_image"), TiledImage) and isinstance(packed.get("new_image"), TiledImage):
+            packed["delta"] = PixelDelta(packed.pop("previous_image"), packed.pop("new_image"))
+        for name, value in packed.items():
+            if isinstance(value, Layer):
+                packed[name] = PackedLayer(value)
+        return packed
+
+    @staticmethod
+    def unpack_params(params):
+        return {name: value.unpack() if isinstance(value, PackedLayer) else value for name, value in params.items()}
+
+    @staticmethod
+    def entry_size(params):
+        return sum(value.nbytes for value in params.values() if isinstance(value, (PixelDelta, PackedLayer)))
+
+    def memory_usage(self):
+        return sum(action["size"] for action in self.undo_stack + self.redo_stack if "spilled" not in action)
+
+    def enforce_budget(self):
+        usage = self.memory_usage()
+        # Oldest undo entries go first, then the redo entries furthest from the current state
+        for stack in (self.undo_stack, self.redo_stack):
+            index = 0
+            while usage > self.max_bytes and index < len(stack):
+                action = stack[index]
+                if "spilled" in action:
+                    index += 1
+                    continue
+                if not self.spill_to_disk:
+                    del stack[index]
+                    usage -= action["size"]
+                    continue
+                # Only packed entries can be spilled, the others hold live objects (strokes) that undo looks up
+                if action["size"] > 0:
+                    self.spill(action)
+                    usage -= action["size"]
+                index += 1
+
+    def spill(self, action):
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(prefix="history_")
+        data = pickle.dumps(action["params"], protocol=pickle.HIGHEST_PROTOCOL)
+        self.spill_file.seek(0, 2)
+        action["spilled"] = (self.spill_file.tell(), len(data))
+        self.spill_file.write(data)
+        action["params"] = None
+
+    def load(self, action):
+        if "spilled" in action:
+            position, length = action.pop("spilled")
+            self.spill_file.seek(position)
+            action["params"] = pickle.loads(self.spill_file.read(length))
+        return action
 
     def record_action(self, action_type, params):
+        params = self.pack_params(params)
         action = {
             "type": action_type,
-            "params": params
+            "params": params,
+            "size": self.entry_size(params)
         }
         self.undo_stack.append(action)
         self.redo_stack.clear()
+        self.enforce_budget()
 
     def undo(self):
 
         if not self.undo_stack:
             return None
 
-        action = self.undo_stack.pop()
+        action = self.load(self.undo_stack.pop())
         self.redo_stack.append(action)
+        self.enforce_budget()
 
-
-        return action
+        return {"type": action["type"], "params": self.unpack_params(action["params"])}
 
     def redo(self):
 
         if not self.redo_stack:
             return None
 
-        action = self.redo_stack.pop()
+        action = self.load(self.redo_stack.pop())
         self.undo_stack.append(action)
+        self.enforce_budget()
 
-        return action
+        return {"type": action["type"], "params": self.unpack_params(action["params"])}
 
 
 class RotateTool(Tool):
@@ -142,22 +348,20 @@ class RotateTool(Tool):
     def start_action(self, event, *args, **kwargs):
         self.start_x, self.start_y = event.x, event.y
 
-    def perform_action(self, event, original_image, angle):
-
+    def perform_action(self, event, transform, image_size):
+        # Only the matrix changes here, the layer is resampled at render time
         dx = event.x - self.start_x
         dy = event.y - self.start_y
         angle_change = (dx - dy) / 5
 
-        new_angle = angle + angle_change
-
-        (h, w) = original_image.shape[:2]
-        center = (w // 2, h // 2)
+        (w, h) = image_size
+        center = transform_points(transform, [(w / 2, h / 2)])[0]
 
-        rotation_matrix = cv2.getRotationMatrix2D(center, new_angle, 1.0)
-        rotated_image = cv2.warpAffine(original_image, rotation_matrix, (w, h))
+        # Rotate about the image center as it is currently displayed
+        rotation_matrix = cv2.getRotationMatrix2D((float(center[0]), float(center[1])), angle_change, 1.0)
 
         self.start_x = event.x
         self.start_y = event.y
 
-        return rotated_image, new_angle
+        return compose_transforms(rotation_matrix, transform)
 